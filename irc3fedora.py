@@ -1,26 +1,44 @@
 # -*- coding: utf-8 -*-
+import array
+import bisect
+import collections
 import datetime
+import functools
+import heapq
 import logging
 import logging.config
+import os
+import re
+import socket
+import sqlite3
+import ssl
+import stat
+import struct
+import sys
 import threading
 import time
 import urllib
 import urllib2
+import urlparse
+import zlib
 
-from itertools import chain, islice, tee
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from itertools import chain, groupby, islice, tee
 from operator import itemgetter
 
 import arrow
 import fedmsg.config
+import fedmsg.core
 import fedmsg.meta
 import irc3
 import pytz
-import requests
 import simplejson
 
 from irc3d import IrcServer
 from irc3.compat import asyncio
 from irc3.plugins.command import command
+from trollius import From, Return
 
 from fedora.client import AppError
 from fedora.client import AuthError
@@ -32,8 +50,30 @@ from pkgdb2client import PkgDB
 
 FAS = None
 
+bugzacl_url = 'https://admin.fedoraproject.org/pkgdb/api/bugzilla'
+# How many items of a long answer are shown at once, see Cursors
+PAGE_SIZE = 50
+SEARCH_RESULTS = 10
+# The calendars of the people doing something right now, and how much of
+# them we fetch around the time we are interested in.
+CALENDARS = ['release-engineering', 'vacation']
+CALENDAR_PAST = datetime.timedelta(days=62)
+CALENDAR_FUTURE = datetime.timedelta(days=62)
+ACL_LOADING = 'The package list is still loading, please try again later.'
+# How many usernames hellomynameis and localtime look up at once
+MAX_USERNAMES = 30
+TOO_MANY_USERNAMES = 'Sorry, I look up at most %d usernames at once.' % (
+    MAX_USERNAMES)
+# The longest line an IRC server accepts, in bytes, and the longest prefix
+# it adds to our messages when relaying them: ``:<nick>!<user>@<host> ``,
+# with up to 10 bytes for the user and 63 for the host, besides the nick.
+IRC_LINE_LENGTH = 512
+HOSTMASK_LENGTH = 77
+
 # The variables, classes and methods below are used for the ``quote`` command
 SPARKLINE_RESOLUTION = 50
+# In seconds, divides the width of the sparkline buckets of every timeframe
+HISTOGRAM_RESOLUTION = 144
 datagrepper_url = 'https://apps.fedoraproject.org/datagrepper/raw'
 
 
@@ -56,6 +96,16 @@ class Utils(object):
         unicode_sparkline = u''.join([bar[i] for i in indices])
         return unicode_sparkline
 
+    @classmethod
+    def align(cls, when, delta):
+        """ Return the first multiple of ``delta`` since the epoch which
+        comes after ``when``.
+        """
+        step = delta.total_seconds()
+        elapsed = epoch_seconds(when)
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(
+            seconds=(elapsed // step + 1) * step)
+
     @classmethod
     def daterange(cls, start, stop, steps):
         """ A generator for stepping through time. """
@@ -66,56 +116,1705 @@ class Utils(object):
             current += delta
 
 
-class WorkerThread(threading.Thread):
-    """ A simple worker thread for our threadpool. """
+class Unavailable(Exception):
+    """ Raised when an upstream service does not answer, or not in time. """
 
-    def __init__(self, fn, item, *args, **kwargs):
-        self.fn = fn
-        self.item = item
-        super(WorkerThread, self).__init__(*args, **kwargs)
+    def __init__(self, service):
+        super(Unavailable, self).__init__(service)
+        self.service = service
+
+    def __str__(self):
+        return '%s is not answering right now' % self.service
 
-    def run(self):
-        self.result = self.fn(self.item)
 
+class HTTPError(Exception):
+    """ Raised when a web service answers something else than we asked. """
 
-class ThreadPool(object):
-    """ Our very own threadpool implementation.
+    def __init__(self, url, status, reason=None):
+        super(HTTPError, self).__init__(url, status)
+        self.url = url
+        self.status = status
+        self.reason = reason or 'with a %d status' % status
 
-    We make our own thing because multiprocessing is too heavy.
+    def __str__(self):
+        return '%s answered %s' % (urlparse.urlsplit(self.url).hostname,
+                                   self.reason)
+
+
+class CircuitBreaker(object):
+    """ Fail fast when an upstream service keeps failing.
+
+    After ``threshold`` consecutive failures the circuit opens: calls are
+    refused right away, raising Unavailable, for ``reset`` seconds.  Then a
+    single call is let through to probe the service, its success closes the
+    circuit again while its failure keeps it open for another ``reset``.
+    Every call allowed must be followed by ``success`` or ``failure``.
     """
 
-    def map(self, fn, items):
-        threads = []
+    def __init__(self, service, threshold=5, reset=60):
+        self.service = service
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened is None:
+                return
+            if self.probing or time.time() < self.opened + self.reset:
+                raise Unavailable(self.service)
+            self.probing = True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.opened is not None or self.failures >= self.threshold:
+                self.opened = time.time()
+
+
+class SingleFlight(object):
+    """ Let concurrent identical calls share a single upstream call.
+
+    The first caller for a given key does the call, whoever asks for the
+    same key while it is in flight waits for it and gets the same result
+    (or exception).  ``saved`` counts the calls we did not have to do.
+    """
 
-        for item in items:
-            threads.append(WorkerThread(fn=fn, item=item))
+    def __init__(self, name):
+        self.name = name
+        self.saved = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.saved += 1
+        if not leader:
+            return call.result()
 
-        for thread in threads:
-            thread.start()
+        try:
+            result = fn()
+        except BaseException as exc:
+            # Even KeyboardInterrupt and the like, the others would
+            # otherwise wait forever.
+            call.set_exception(exc)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
 
-        for thread in threads:
-            thread.join()
+    def stats(self):
+        return '%s: %d calls saved' % (self.name, self.saved)
 
-        return [thread.result for thread in threads]
 
+class HTTPClient(object):
+    """ A coroutine based HTTP/1.1 client for the upstream web services.
 
-def datagrepper_query(kwargs):
-    """ Return the count of msgs filtered by kwargs for a given time.
+    Connections are kept alive and reused, per host.  At most ``limit``
+    requests are in flight per host, the others wait for their turn, and a
+    request has ``timeout`` seconds to complete once it got it.  Identical
+    JSON requests made while one is in flight share its answer.
 
-    The arguments for this are a little clumsy; this is imposed on us by
-    multiprocessing.Pool.
+    Each host has its CircuitBreaker, built by ``breaker``.  Hosts timing
+    out, failing to connect or answering a server error raise Unavailable.
+    Redirections are followed, up to ``max_redirects`` of them.
     """
+
+    redirects = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    def __init__(self, loop, limit=8, timeout=30, breaker=CircuitBreaker):
+        self.loop = loop
+        self.limit = limit
+        self.timeout = timeout
+        self.breaker = breaker
+        self.connections = self.saved = 0
+        self.breakers = {}
+        self._ssl = ssl.create_default_context()
+        self._idle = collections.defaultdict(list)
+        self._slots = {}
+        self._inflight = {}
+
+    def stats(self):
+        return 'http: %d connections opened, %d calls saved' % (
+            self.connections, self.saved)
+
+    @asyncio.coroutine
+    def get_json(self, url, timeout=None, accept_errors=False, **params):
+        """ GET ``url`` and return the JSON it answers.
+
+        Raise HTTPError if it does not answer JSON or, unless
+        ``accept_errors``, if the status is not a success.  The answer may
+        be shared with other callers, it must therefore not be modified.
+        """
+        key = (url, accept_errors, tuple(sorted(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in params.items())))
+        if key in self._inflight:
+            self.saved += 1
+            result = yield From(
+                asyncio.shield(self._inflight[key], loop=self.loop))
+            raise Return(result)
+
+        future = self._inflight[key] = asyncio.Future(loop=self.loop)
+        try:
+            status, body = yield From(
+                self.get(url, timeout=timeout, **params))
+            if not accept_errors and not 200 <= status < 300:
+                raise HTTPError(url, status)
+            try:
+                result = simplejson.loads(body)
+            except ValueError:
+                raise HTTPError(url, status, 'something else than JSON')
+        except Exception as exc:
+            future.set_exception(exc)
+            # Whoever shares it gets it, we raise it ourselves just below.
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(result)
+        raise Return(result)
+
+    @asyncio.coroutine
+    def get(self, url, timeout=None, **params):
+        """ GET ``url`` and return the status code and body answered. """
+        for _ in range(self.max_redirects + 1):
+            status, headers, body = yield From(
+                self._request(url, timeout, params))
+            if status not in self.redirects or 'location' not in headers:
+                raise Return((status, body))
+            # The location has the query string already.
+            url = urlparse.urljoin(url, headers['location'])
+            params = {}
+        raise HTTPError(url, status)
+
+    @asyncio.coroutine
+    def _request(self, url, timeout, params):
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        query = '&'.join(filter(None, [
+            parts.query, urllib.urlencode(params, doseq=True)]))
+        if query:
+            path += '?' + query
+        default_port = 443 if parts.scheme == 'https' else 80
+        host = (parts.scheme, parts.hostname, parts.port or default_port)
+
+        slots = self._slots.get(host)
+        if slots is None:
+            slots = self._slots[host] = asyncio.Semaphore(
+                self.limit, loop=self.loop)
+            self.breakers[host] = self.breaker(host[1])
+        breaker = self.breakers[host]
+
+        breaker.allow()
+        yield From(slots.acquire())
+        try:
+            response = yield From(asyncio.wait_for(
+                self._get(host, path), timeout or self.timeout,
+                loop=self.loop))
+        except (asyncio.TimeoutError, EnvironmentError, EOFError):
+            breaker.failure()
+            raise Unavailable(host[1])
+        except Exception:
+            breaker.failure()
+            raise
+        finally:
+            slots.release()
+
+        if response[0] >= 500:
+            breaker.failure()
+            raise Unavailable(host[1])
+        breaker.success()
+        raise Return(response)
+
+    @asyncio.coroutine
+    def _get(self, host, path):
+        while True:
+            reader, writer, reused = yield From(self._connection(host))
+            try:
+                response = yield From(
+                    self._exchange(host, path, reader, writer))
+            except Exception:
+                writer.close()
+                raise
+            if response is not None:
+                raise Return(response)
+            writer.close()
+            # The server may close a connection while it is idle, only a
+            # new one not answering anything is an error.
+            if not reused:
+                raise IOError('%s closed the connection' % host[1])
+
+    @asyncio.coroutine
+    def _connection(self, host):
+        idle = self._idle[host]
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                raise Return((reader, writer, True))
+            writer.close()
+
+        scheme, hostname, port = host
+        reader, writer = yield From(asyncio.open_connection(
+            hostname, port, ssl=self._ssl if scheme == 'https' else None,
+            loop=self.loop))
+        self.connections += 1
+        raise Return((reader, writer, False))
+
+    @asyncio.coroutine
+    def _exchange(self, host, path, reader, writer):
+        """ Send a GET request for ``path`` and read the answer.
+
+        Return None if the connection got closed before we got any.
+        """
+        writer.write(
+            'GET %s HTTP/1.1\r\n'
+            'Host: %s\r\n'
+            'User-Agent: irc3fedora\r\n'
+            'Accept: application/json\r\n'
+            'Accept-Encoding: gzip\r\n'
+            '\r\n' % (path, host[1]))
+
+        line = yield From(reader.readline())
+        if not line:
+            raise Return(None)
+        version, status = line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = yield From(reader.readline())
+            if not line.strip():
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                line = yield From(reader.readline())
+                size = int(line.split(';')[0], 16)
+                if not size:
+                    break
+                chunk = yield From(reader.readexactly(size))
+                chunks.append(chunk)
+                yield From(reader.readline())
+            # Skip the trailer, if any, up to the final empty line.
+            while True:
+                line = yield From(reader.readline())
+                if not line.strip():
+                    break
+            body = ''.join(chunks)
+        elif 'content-length' in headers:
+            body = yield From(
+                reader.readexactly(int(headers['content-length'])))
+        else:
+            body = yield From(reader.read())
+            headers['connection'] = 'close'
+
+        idle = self._idle[host]
+        if (version == 'HTTP/1.0' or
+                headers.get('connection', '').lower() == 'close'):
+            writer.close()
+        elif len(idle) < self.limit:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+        if headers.get('content-encoding', '').lower() == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        raise Return((int(status), headers, body))
+
+
+@asyncio.coroutine
+def datagrepper_query(http, kwargs):
+    """ Return the count of msgs filtered by kwargs for a given time. """
     start, end = kwargs.pop('start'), kwargs.pop('end')
     params = {
-        'start': time.mktime(start.timetuple()),
-        'end': time.mktime(end.timetuple()),
+        'start': epoch_seconds(start),
+        'end': epoch_seconds(end),
     }
     params.update(kwargs)
 
-    req = requests.get(datagrepper_url, params=params)
-    json_out = simplejson.loads(req.text)
+    json_out = yield From(http.get_json(datagrepper_url, **params))
     result = int(json_out['total'])
-    return result
+    raise Return(result)
+
+
+def epoch_seconds(when):
+    """ Return the number of seconds from the epoch to the naive UTC
+    datetime ``when``.
+    """
+    return (when - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+class Histogram(object):
+    """ Counts of the messages seen on the bus, per category.
+
+    Each category has a ring buffer of ``size`` buckets of ``resolution``
+    seconds, so we remember the last ``size * resolution`` seconds.  The
+    default resolution divides the width of the sparkline buckets of every
+    ``quote`` timeframe, so those buckets are sums of whole buckets of ours.
+    """
+
+    def __init__(self, resolution=HISTOGRAM_RESOLUTION, size=8400):
+        self.resolution = resolution
+        self.size = size
+        # Bucket being filled and first bucket we have seen entirely.
+        self.current = int(time.time() // resolution)
+        self.first = self.current + 1
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def _advance(self, bucket):
+        # Buckets we skip over were empty, reset what the ring holds there.
+        for skipped in range(max(self.current + 1, bucket - self.size + 1),
+                             bucket + 1):
+            for counts in self.counts.values():
+                counts[skipped % self.size] = 0
+        self.current = bucket
+
+    def record(self, category, timestamp):
+        bucket = int(timestamp // self.resolution)
+        with self._lock:
+            if bucket > self.current:
+                self._advance(bucket)
+            if bucket <= self.current - self.size:
+                return
+            if category not in self.counts:
+                self.counts[category] = array.array('L', [0] * self.size)
+            self.counts[category][bucket % self.size] += 1
+
+    def count(self, category, start, end):
+        """ Return the number of messages of ``category`` seen between the
+        naive UTC datetimes ``start`` and ``end``, or None if we were not
+        listening to the bus for all of that time.
+        """
+        first = epoch_seconds(start) / self.resolution
+        last = epoch_seconds(end) / self.resolution
+        if first != int(first) or last != int(last):
+            return None
+        first, last = int(first), int(last)
+
+        with self._lock:
+            if first < max(self.first, self.current - self.size + 1):
+                return None
+            counts = self.counts.get(category)
+            if counts is None:
+                return 0
+            return sum(
+                counts[bucket % self.size]
+                for bucket in range(first, min(last, self.current + 1)))
+
+
+class BusListener(threading.Thread):
+    """ Follow the fedmsg bus and hand every message to the ``handlers``.
+
+    Handlers are called from this thread with the topic and the message.
+    """
+
+    def __init__(self, config, handlers):
+        super(BusListener, self).__init__(name='fedmsg')
+        self.daemon = True
+        self.config = config
+        self.handlers = handlers
+        self.log = logging.getLogger('irc3.%s' % __name__)
+
+    def run(self):
+        context = fedmsg.core.FedMsgContext(**self.config)
+        for _, _, topic, msg in context.tail_messages():
+            for handler in self.handlers:
+                try:
+                    handler(topic, msg)
+                except Exception as exc:
+                    self.log.error('Could not handle %s: %r', topic, exc)
+
+
+def wire_dumps(value):
+    """ Return ``value`` as the JSON kept by SQLiteStore, or sent to or by
+    the CacheDaemon.
+
+    Besides what JSON has, tuples, naive datetimes, GroupMembers and the
+    meeting indexes are tagged so wire_loads gives them back.  The records
+    FAS answers are dicts, they go as plain dicts.
+    """
+    def tag(value):
+        if isinstance(value, GroupMembers):
+            return {'!group': tag(dict(value._asdict()))}
+        if isinstance(value, tuple):
+            return {'!tuple': [tag(item) for item in value]}
+        if isinstance(value, list):
+            return [tag(item) for item in value]
+        if isinstance(value, dict):
+            return dict((key, tag(item)) for key, item in value.items())
+        if isinstance(value, datetime.datetime) and value.tzinfo is None:
+            return {'!datetime': list(value.timetuple()[:6]) + [
+                value.microsecond]}
+        if isinstance(value, (MeetingIndex, IntervalIndex)):
+            return {'!object': [type(value).__name__, tag(value.__dict__)]}
+        if value is None or isinstance(
+                value, (basestring, bool, int, long, float)):
+            return value
+        raise TypeError('%r cannot be sent to the cache daemon' % (value,))
+
+    return simplejson.dumps(
+        tag(value), separators=(',', ':'), sort_keys=True)
+
+
+def wire_loads(data):
+    """ Return the value wire_dumps gave ``data`` for. """
+    def untag(value):
+        if len(value) != 1:
+            return value
+        name, item = value.items()[0]
+        if name == '!tuple':
+            return tuple(item)
+        if name == '!datetime':
+            return datetime.datetime(*item)
+        if name == '!group':
+            return GroupMembers(**item)
+        if name == '!object':
+            cls = {'MeetingIndex': MeetingIndex,
+                   'IntervalIndex': IntervalIndex}[item[0]]
+            value = cls.__new__(cls)
+            value.__dict__.update(item[1])
+        return value
+
+    return simplejson.loads(data, object_hook=untag)
+
+
+class SQLiteStore(object):
+    """ Cache entries on disk, so they outlive a restart of the bot.
+
+    The entries of every cache are kept as JSON, see wire_dumps, in one
+    SQLite database in WAL mode: each thread has its own connection, and
+    readers never wait for the writer.  Each cache keeps at most its
+    ``maxsize`` of weight there, the entries stored first are evicted
+    first.  The store is an optional help, its errors are logged and it then
+    behaves as if empty.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.log = logging.getLogger('irc3.%s' % __name__)
+        self._local = threading.local()
+        db = self._connection()
+        db.execute('PRAGMA journal_mode=WAL')
+        with db:
+            # The entries used to be pickled, they are of no use now.
+            if not db.execute('PRAGMA user_version').fetchone()[0]:
+                db.execute('DROP TABLE IF EXISTS entries')
+                db.execute('DROP TABLE IF EXISTS sizes')
+                db.execute('PRAGMA user_version = 1')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'cache TEXT, key TEXT, stored REAL, expires REAL, '
+                'weight INTEGER, value TEXT, PRIMARY KEY (cache, key))')
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS entries_stored '
+                'ON entries (cache, stored)')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS sizes ('
+                'cache TEXT PRIMARY KEY, size INTEGER)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def get(self, cache, key):
+        """ Return the (expires, value, weight) stored for ``key``, raise
+        KeyError if there is none.
+        """
+        try:
+            row = self._connection().execute(
+                'SELECT expires, value, weight FROM entries '
+                'WHERE cache = ? AND key = ?',
+                (cache, wire_dumps(key))).fetchone()
+            if row is not None:
+                expires, value, weight = row
+                return expires, wire_loads(value), weight
+        except Exception as exc:
+            self.log.warning('Could not read %r from %s: %r', key, cache, exc)
+        raise KeyError(key)
+
+    def set(self, cache, key, expires, value, weight=1, maxsize=None):
+        """ Store ``value`` for ``key`` and evict what is over ``maxsize``,
+        if given.
+        """
+        try:
+            text = wire_dumps(key)
+            value = wire_dumps(value)
+            with self._connection() as db:
+                self._delete(db, cache, text)
+                db.execute(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                    (cache, text, time.time(), expires, weight, value))
+                self._resize(db, cache, weight)
+                if maxsize is not None:
+                    self._evict(db, cache, maxsize)
+        except Exception as exc:
+            self.log.warning('Could not store %r in %s: %r', key, cache, exc)
+
+    def delete(self, cache, key):
+        try:
+            with self._connection() as db:
+                self._delete(db, cache, wire_dumps(key))
+        except Exception as exc:
+            self.log.warning('Could not delete %r from %s: %r',
+                             key, cache, exc)
+
+    def _delete(self, db, cache, key):
+        row = db.execute(
+            'SELECT weight FROM entries WHERE cache = ? AND key = ?',
+            (cache, key)).fetchone()
+        if row is not None:
+            db.execute(
+                'DELETE FROM entries WHERE cache = ? AND key = ?',
+                (cache, key))
+            self._resize(db, cache, -row[0])
+
+    def _resize(self, db, cache, delta):
+        db.execute(
+            'INSERT OR IGNORE INTO sizes VALUES (?, 0)', (cache,))
+        db.execute(
+            'UPDATE sizes SET size = size + ? WHERE cache = ?',
+            (delta, cache))
+
+    def _evict(self, db, cache, maxsize):
+        size, = db.execute(
+            'SELECT size FROM sizes WHERE cache = ?', (cache,)).fetchone()
+        if size <= maxsize:
+            return
+        evicted = []
+        for key, weight in db.execute(
+                'SELECT key, weight FROM entries WHERE cache = ? '
+                'ORDER BY stored', (cache,)):
+            if size <= maxsize:
+                break
+            evicted.append((cache, key))
+            size -= weight
+        db.executemany(
+            'DELETE FROM entries WHERE cache = ? AND key = ?', evicted)
+        db.execute(
+            'UPDATE sizes SET size = ? WHERE cache = ?', (size, cache))
+
+
+class MemoryStore(object):
+    """ Cache entries in memory, bounded the same way as in SQLiteStore.
+
+    It is what the CacheDaemon serves when it has no database, it must
+    therefore only be used from the event loop.
+    """
+
+    def __init__(self):
+        self.caches = collections.defaultdict(collections.OrderedDict)
+        self.sizes = collections.defaultdict(int)
+
+    def get(self, cache, key):
+        return self.caches[cache][key]
+
+    def set(self, cache, key, expires, value, weight=1, maxsize=None):
+        self.delete(cache, key)
+        entries = self.caches[cache]
+        entries[key] = (expires, value, weight)
+        self.sizes[cache] += weight
+        while (maxsize is not None and self.sizes[cache] > maxsize and
+                len(entries) > 1):
+            _, (_, _, evicted) = entries.popitem(last=False)
+            self.sizes[cache] -= evicted
+
+    def delete(self, cache, key):
+        entry = self.caches[cache].pop(key, None)
+        if entry is not None:
+            self.sizes[cache] -= entry[2]
+
+
+class TTLCache(object):
+    """ A thread-safe, size bounded cache whose entries expire.
+
+    Entries older than ``ttl`` seconds are not fresh anymore and, once the
+    entries weigh more than ``maxsize``, the least recently used ones are
+    evicted.  Each entry weighs 1 unless a ``sizeof`` function is given.
+    Hits, misses and evictions are counted so we can see how well it works.
+
+    Given an ``executor``, ``fetch`` serves entries up to ``stale`` seconds
+    past their expiry right away, revalidating them in the background.
+    Expired entries are also served, whatever their age, when recomputing
+    them raises Unavailable.
+
+    Given a ``store``, like SQLiteStore, the entries are also written there
+    and the ones missing in memory are looked up there.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=300, sizeof=None, stale=0,
+                 executor=None, store=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 1)
+        self.stale = stale
+        self.executor = executor
+        self.store = store
+        self.size = 0
+        self.hits = self.misses = self.evictions = self.served_stale = 0
+        self.flights = SingleFlight(name)
+        self._data = collections.OrderedDict()
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key):
+        # Must be called without the lock held, the store is read without
+        # it.  Re-inserting the entry marks it as the most recently used one.
+        with self._lock:
+            try:
+                entry = self._data.pop(key)
+            except KeyError:
+                if self.store is None:
+                    raise
+            else:
+                self._data[key] = entry
+                return entry
+        entry = self.store.get(self.name, key)
+        with self._lock:
+            # Unless it got set meanwhile, which is then more recent.
+            if key in self._data:
+                return self._data[key]
+            self.size += entry[2]
+            self._data[key] = entry
+            self._evict()
+        return entry
+
+    def get(self, key):
+        """ Return the fresh value cached for ``key``, raise KeyError if
+        there is none.
+        """
+        try:
+            expires, value, _ = self._lookup(key)
+        except KeyError:
+            with self._lock:
+                self.misses += 1
+            raise
+        with self._lock:
+            if expires < time.time():
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        weight = self.sizeof(value)
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (expires, value, weight)
+            self.size += weight
+            self._evict()
+        if self.store is not None:
+            self.store.set(
+                self.name, key, expires, value, weight, self.maxsize)
+
+    def _evict(self):
+        # Must be called with the lock held.
+        while self.size > self.maxsize and len(self._data) > 1:
+            _, (_, _, evicted) = self._data.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+        if self.store is not None:
+            self.store.delete(self.name, key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def fetch(self, key, creator):
+        """ Return the value cached for ``key``, calling ``creator`` to
+        compute (and cache) it when there is none.
+
+        Concurrent misses on the same key share a single call to
+        ``creator``.
+        """
+        now = time.time()
+        try:
+            expires, value, _ = self._lookup(key)
+        except KeyError:
+            expires = None
+        with self._lock:
+            if expires is not None and now <= expires:
+                self.hits += 1
+                return value
+            revalidate = (
+                expires is not None and self.executor is not None and
+                now <= expires + self.stale)
+            if revalidate:
+                self.served_stale += 1
+                if key not in self._revalidating:
+                    self._revalidating.add(key)
+                    self.executor.submit(self._revalidate, key, creator)
+                return value
+            self.misses += 1
+
+        try:
+            return self.flights.do(key, functools.partial(
+                self._create, key, creator))
+        except Unavailable:
+            if expires is None:
+                raise
+            with self._lock:
+                self.served_stale += 1
+            return value
+
+    def _create(self, key, creator):
+        value = creator()
+        self.set(key, value)
+        return value
+
+    def _revalidate(self, key, creator):
+        try:
+            self.flights.do(key, functools.partial(
+                self._create, key, creator))
+        except Exception:
+            # We will try again next time, the stale value stays meanwhile.
+            pass
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+    def stats(self):
+        return (
+            '%s: %d entries, %d hits, %d misses, %d evictions, '
+            '%d served stale, %d calls saved' % (
+                self.name, len(self), self.hits, self.misses, self.evictions,
+                self.served_stale, self.flights.saved))
+
+
+GroupMembers = collections.namedtuple(
+    'GroupMembers', ['administrators', 'sponsors', 'users'])
+
+
+def split_group_members(members):
+    """ Sort the members of a FAS group by their role in it. """
+    roles = dict(administrator=[], sponsor=[], user=[])
+    for person in members:
+        roles.get(person['role_type'], roles['user']).append(
+            person['username'])
+    return GroupMembers(
+        administrators=tuple(roles['administrator']),
+        sponsors=tuple(roles['sponsor']),
+        users=tuple(roles['user']),
+    )
+
+
+class SearchIndex(object):
+    """ An inverted index of the words found in package names and summaries.
+
+    Words of the package name weigh more than those of its summary.  The
+    words of each package are kept so that, when the index is rebuilt from
+    the ``previous`` one, only the new or modified packages are tokenized.
+    """
+
+    name_weight = 3
+    summary_weight = 1
+
+    # How many words a prefix may expand to, the most common ones are kept.
+    max_expansions = 200
+
+    def __init__(self, summaries, previous=None):
+        known = previous.words if previous else {}
+        self.words = {}
+        postings = collections.defaultdict(dict)
+        for package, summary in summaries.items():
+            entry = known.get(package)
+            if entry is None or entry[0] != summary:
+                entry = (summary, self.weigh(package, summary))
+            self.words[package] = entry
+            for word, weight in entry[1]:
+                postings[word][package] = weight
+        self.postings = dict(postings)
+        self.vocabulary = sorted(self.postings)
+
+    @classmethod
+    def tokenize(cls, text):
+        return re.findall(r'[a-z0-9]+', (text or '').lower())
+
+    @classmethod
+    def weigh(cls, package, summary):
+        """ Return a tuple of (word, weight) for ``package``. """
+        weights = dict(
+            (word, cls.summary_weight) for word in cls.tokenize(summary))
+        for word in cls.tokenize(package) + [package.lower()]:
+            weights[word] = cls.name_weight
+        return tuple(weights.items())
+
+    def expand(self, prefix):
+        """ Return the words of the index starting with ``prefix`` and
+        whether some were left out.
+
+        Past ``max_expansions`` words, the ones found in the most packages
+        are kept, and ``prefix`` itself if it is a word.
+        """
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(
+            self.vocabulary, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        if end - start <= self.max_expansions:
+            return self.vocabulary[start:end], False
+        words = heapq.nlargest(
+            self.max_expansions, islice(self.vocabulary, start, end),
+            key=lambda word: len(self.postings[word]))
+        if prefix in self.postings and prefix not in words:
+            words.append(prefix)
+        return words, True
+
+    def query(self, text):
+        """ Return the packages matching every word of ``text``, best
+        matches first, and whether some matches may have been left out.
+
+        A word matches the words of the index it is a prefix of, matching a
+        whole word counts twice as much as matching its beginning.
+        """
+        words = self.tokenize(text)
+        if not words:
+            return [], False
+
+        scores = None
+        truncated = False
+        for word in words:
+            matches = {}
+            candidates, partial = self.expand(word)
+            truncated = truncated or partial
+            for candidate in candidates:
+                factor = 2 if candidate == word else 1
+                for package, weight in self.postings[candidate].items():
+                    score = weight * factor
+                    if score > matches.get(package, 0):
+                        matches[package] = score
+            if scores is None:
+                scores = matches
+            else:
+                scores = dict(
+                    (package, score + matches[package])
+                    for package, score in scores.items()
+                    if package in matches)
+            if not scores:
+                return [], truncated
+
+        whole = text.strip().lower()
+        if whole in scores:
+            scores[whole] += 100
+
+        return sorted(
+            scores, key=lambda package: (-scores[package], len(package),
+                                         package)), truncated
+
+
+class PackageIndex(object):
+    """ The package summaries and owners, indexed from the pkgdb ACLs.
+
+    The index is built once per download of the ACLs and never modified
+    afterwards.  For each package of the Fedora collection, we keep its
+    owner along with the owners it has in other collections, when they
+    differ.  For each owner, we keep the packages they own per collection.
+    Owner and collection names are stored only once, the ACLs repeat them
+    tens of thousands of times.
+
+    Passing the ``previous`` index lets the search index reuse the work
+    done for the packages which did not change since.
+    """
+
+    def __init__(self, bugzacl=None, previous=None):
+        bugzacl = bugzacl or {}
+        fedora = bugzacl.get('Fedora', {})
+        strings = {}
+        intern = lambda string: strings.setdefault(string, string)
+
+        others = collections.defaultdict(list)
+        owned = collections.defaultdict(lambda: collections.defaultdict(list))
+        for collection in sorted(bugzacl):
+            name = intern(collection)
+            for package, acl in bugzacl[collection].items():
+                owner = intern(acl['owner'])
+                owned[owner][name].append(intern(package))
+                if collection == 'Fedora' or package not in fedora:
+                    continue
+                if owner != fedora[package]['owner']:
+                    others[package].append((owner, name))
+
+        # Fedora first, then the other collections in alphabetical order.
+        self.packages_by_owner = dict(
+            (owner, tuple(
+                (name, tuple(sorted(packages)))
+                for name, packages in sorted(
+                    by_collection.items(),
+                    key=lambda item: (item[0] != 'Fedora', item[0]))
+            ))
+            for owner, by_collection in owned.items()
+        )
+
+        self.summaries = {}
+        self.owners = {}
+        for package, acl in fedora.items():
+            self.summaries[package] = acl['summary']
+            self.owners[package] = (
+                intern(acl['owner']), tuple(others.get(package, ())))
+
+        self.search = SearchIndex(
+            self.summaries, previous.search if previous else None)
+
+    def __len__(self):
+        return len(self.summaries)
+
+    def summary(self, package):
+        """ Return the summary of ``package``, raise KeyError if unknown. """
+        return self.summaries[package]
+
+    def owner(self, package):
+        """ Return the owner of ``package`` in Fedora and a tuple of
+        (owner, collection) for the collections where it differs.
+        """
+        return self.owners[package]
+
+    def owned_by(self, username):
+        """ Return a tuple of (collection, packages) for the packages owned
+        by ``username``, empty if there are none.
+        """
+        return self.packages_by_owner.get(username, ())
+
+
+def load_acls(snapshot):
+    """ Return the PackageIndex of the ``snapshot`` of the ACLs, an empty
+    one if there is none.
+    """
+    if not snapshot or not os.path.exists(snapshot):
+        return PackageIndex()
+    logging.getLogger('irc3.%s' % __name__).info(
+        "Loading package owners cache from %s", snapshot)
+    with open(snapshot) as stream:
+        return PackageIndex(simplejson.load(stream)['bugzillaAcls'])
+
+
+def index_acls(body, previous=None, snapshot=None):
+    """ Return the PackageIndex of the ACLs pkgdb answered, ``body``, and
+    save them as the ``snapshot`` if given.
+    """
+    packages = PackageIndex(simplejson.loads(body)['bugzillaAcls'], previous)
+
+    if snapshot:
+        # Write aside and rename so a crash never leaves half a snapshot.
+        tmp = snapshot + '.tmp'
+        with open(tmp, 'wb') as stream:
+            stream.write(body)
+        os.rename(tmp, snapshot)
+
+    return packages
+
+
+@asyncio.coroutine
+def download_acls(loop, http, executor, timeout, previous=None,
+                  snapshot=None):
+    """ Download the ACLs from pkgdb and return their PackageIndex. """
+    logging.getLogger('irc3.%s' % __name__).info(
+        "Downloading package owners cache")
+    status, body = yield From(http.get(
+        bugzacl_url, timeout=timeout, format='json'))
+    if status != 200:
+        raise IOError('pkgdb answered %d' % status)
+    # Decoding and indexing hundreds of MB takes a while.
+    packages = yield From(loop.run_in_executor(
+        executor, index_acls, body, previous, snapshot))
+    raise Return(packages)
+
+
+# Linux's, Python 2 does not name it.
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+
+class CacheClient(object):
+    """ Talk to the CacheDaemon listening on the unix socket ``path``.
+
+    It is a store for TTLCache: the bots using the same daemon share their
+    cache entries, each is looked up upstream once for all of them.  Like
+    SQLiteStore, it behaves as if empty when the daemon does not answer.
+    Each thread has its own connection.
+    """
+
+    # The errors of the daemon raised as such, the others as IOError.
+    errors = {'KeyError': KeyError, 'ValueError': ValueError}
+
+    def __init__(self, path, timeout=1):
+        self.path = path
+        self.timeout = timeout
+        self.log = logging.getLogger('irc3.%s' % __name__)
+        self._local = threading.local()
+
+    def call(self, *request):
+        """ Send ``request`` to the daemon and return its answer, raise
+        what it raised, or Unavailable if it does not answer.
+        """
+        data = wire_dumps(request)
+        try:
+            sock = getattr(self._local, 'sock', None)
+            if sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                self._local.sock = sock
+            sock.sendall(struct.pack('!I', len(data)) + data)
+            size, = struct.unpack('!I', self._read(sock, 4))
+            ok, result = wire_loads(self._read(sock, size))
+        except (EnvironmentError, EOFError) as exc:
+            self.log.warning('Could not call the cache daemon: %r', exc)
+            if getattr(self._local, 'sock', None) is not None:
+                self._local.sock.close()
+                self._local.sock = None
+            raise Unavailable('the cache daemon')
+        if not ok:
+            name, message = result
+            raise self.errors.get(name, IOError)(message)
+        return result
+
+    def _read(self, sock, size):
+        chunks = []
+        while size:
+            chunk = sock.recv(size)
+            if not chunk:
+                raise EOFError('the cache daemon hung up')
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def get(self, cache, key):
+        try:
+            return self.call('get', cache, key)
+        except Unavailable:
+            raise KeyError(key)
+
+    def set(self, cache, key, expires, value, weight=1, maxsize=None):
+        try:
+            self.call('set', cache, key, expires, value, weight, maxsize)
+        except Unavailable:
+            pass
+        except TypeError as exc:
+            self.log.warning('Could not store %r in %s: %r', key, cache, exc)
+
+    def delete(self, cache, key):
+        try:
+            self.call('delete', cache, key)
+        except Unavailable:
+            pass
+
+
+class RemotePackageIndex(object):
+    """ Stands for the PackageIndex of the CacheDaemon, it is empty while
+    the daemon does not answer.  Each method is a round trip to the daemon,
+    it must not be called from the event loop.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.search = self
+
+    def __len__(self):
+        try:
+            return self.client.call('packages', 'len')
+        except Unavailable:
+            return 0
+
+    def summary(self, package):
+        return self.client.call('packages', 'summary', package)
+
+    def owner(self, package):
+        return self.client.call('packages', 'owner', package)
+
+    def owned_by(self, username):
+        return self.client.call('packages', 'owned_by', username)
+
+    def query(self, text):
+        return self.client.call('packages', 'query', text)
+
+
+class CacheDaemon(object):
+    """ Own the package owners and the upstream caches of every bot of the
+    host, which query them over the unix socket ``config['cache_daemon']``.
+
+    The ACLs are then downloaded and indexed once, whatever the number of
+    bots.  The cache entries are kept in the ``cache_store`` database if
+    given, else in memory.  The requests and answers are JSON, see
+    wire_dumps.  The socket is in a directory only our user may access,
+    which is created if needed, and only processes of our user are served.
+    """
+
+    def __init__(self, loop, config):
+        self.loop = loop
+        self.path = config['cache_daemon']
+        self.log = logging.getLogger('irc3.%s' % __name__)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.http = HTTPClient(
+            loop, timeout=float(config.get('http_timeout', 30)))
+        # The database may keep us waiting on its lock, it is used from a
+        # pool of its own so the loop keeps answering meanwhile.
+        self.store = MemoryStore()
+        self.store_executor = None
+        if config.get('cache_store'):
+            self.store = SQLiteStore(config['cache_store'])
+            self.store_executor = ThreadPoolExecutor(max_workers=4)
+        self.acl_snapshot = config.get('acl_snapshot')
+        self.acl_refresh = int(config.get('acl_refresh', 3600))
+        self.acl_timeout = float(config.get('acl_timeout', 300))
+        self.packages = load_acls(self.acl_snapshot)
+        self.operations = {
+            'get': functools.partial(self._stored, 'get'),
+            'set': functools.partial(self._stored, 'set'),
+            'delete': functools.partial(self._stored, 'delete'),
+            'packages': self._packages,
+        }
+
+    @asyncio.coroutine
+    def serve(self):
+        """ Listen on the socket and keep the package owners up to date. """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        info = os.lstat(directory)
+        if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+                info.st_mode & 0o077):
+            raise IOError(
+                '%s must be a directory only we may access' % directory)
+        # What a previous daemon left, nobody else may write there.
+        if os.path.lexists(self.path):
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                raise IOError('%s is not a socket' % self.path)
+            os.remove(self.path)
+        server = yield From(asyncio.start_unix_server(
+            self._serve, self.path, loop=self.loop))
+        self.loop.call_soon(self._refresh)
+        raise Return(server)
+
+    def _refresh(self):
+        future = self.loop.create_task(download_acls(
+            self.loop, self.http, self.executor, self.acl_timeout,
+            self.packages, self.acl_snapshot))
+        future.add_done_callback(self._refreshed)
+
+    def _refreshed(self, future):
+        if future.exception() is None:
+            self.packages = future.result()
+        else:
+            self.log.error(
+                'Could not refresh packages: %r', future.exception())
+        self.loop.call_later(self.acl_refresh, self._refresh)
+
+    def _stored(self, method, *args):
+        """ Call ``method`` of the store, return its result or, for the
+        database, the future of it.
+        """
+        if self.store_executor is None:
+            return getattr(self.store, method)(*args)
+        return self.loop.run_in_executor(
+            self.store_executor, getattr(self.store, method), *args)
+
+    def _packages(self, method, *args):
+        if method == 'len':
+            return len(self.packages)
+        if method == 'query':
+            return self.packages.search.query(*args)
+        if method in ('summary', 'owner', 'owned_by'):
+            return getattr(self.packages, method)(*args)
+        raise ValueError('Unknown method %r' % method)
+
+    def _peer_uid(self, writer):
+        sock = writer.get_extra_info('socket')
+        credentials = sock.getsockopt(
+            socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', credentials)
+        return uid
+
+    @asyncio.coroutine
+    def _serve(self, reader, writer):
+        try:
+            uid = self._peer_uid(writer)
+            if uid != os.getuid():
+                self.log.warning('Refused a connection of user %d', uid)
+                return
+            while True:
+                header = yield From(reader.readexactly(4))
+                size, = struct.unpack('!I', header)
+                data = yield From(reader.readexactly(size))
+                try:
+                    operation = wire_loads(data)
+                    result = self.operations[operation[0]](*operation[1:])
+                    if isinstance(result, asyncio.Future):
+                        result = yield From(result)
+                    answer = wire_dumps((True, result))
+                except Exception as exc:
+                    answer = wire_dumps(
+                        (False, (type(exc).__name__, str(exc))))
+                writer.write(struct.pack('!I', len(answer)) + answer)
+        except (asyncio.IncompleteReadError, EnvironmentError):
+            pass
+        finally:
+            writer.close()
+
+
+class MeetingIndex(object):
+    """ The meetings of the IRC channels, ordered by start time.
+
+    ``meetings`` is an iterable of (location, [(start, meeting), ...]).
+    """
+
+    def __init__(self, meetings=()):
+        self.locations = {}
+        everything = []
+        for location, located in meetings:
+            located = sorted(located, key=itemgetter(0))
+            self.locations[location] = (
+                [start for start, _ in located], located)
+            everything.extend(located)
+        everything.sort(key=itemgetter(0))
+        self.everything = ([start for start, _ in everything], everything)
+
+    def upcoming(self, location=None, now=None):
+        """ Iterate over the (start, meeting) starting after
+        ``now``, at ``location`` or anywhere if None.
+        """
+        now = now or datetime.datetime.utcnow()
+        if location is None:
+            starts, meetings = self.everything
+        else:
+            starts, meetings = self.locations.get(location, ([], []))
+        index = bisect.bisect_right(starts, now)
+        while index < len(meetings):
+            yield meetings[index]
+            index += 1
+
+
+class IntervalIndex(object):
+    """ The items of a calendar, indexed on the time they are active.
+
+    ``intervals`` is an iterable of (start, end, item), the item being
+    active from start to end inclusive.  We keep the sorted start and end
+    points and, for each of them and each span between two of them, the
+    items active there, so finding what is active at some point in time is
+    a bisection.  ``span`` is the (start, end) period the calendar was
+    fetched for, we know nothing about what happens outside of it.
+    """
+
+    def __init__(self, intervals, span=None):
+        intervals = sorted(intervals, key=itemgetter(0))
+        self.span = span
+        self.points = sorted(set(
+            chain.from_iterable((start, end) for start, end, _ in intervals)))
+        self.at_points = []
+        self.between_points = []
+
+        starting = collections.defaultdict(list)
+        ending = collections.defaultdict(list)
+        for index, (start, end, _) in enumerate(intervals):
+            starting[start].append(index)
+            ending[end].append(index)
+
+        active = set()
+        for point in self.points:
+            active.update(starting[point])
+            self.at_points.append(
+                tuple(intervals[index][2] for index in sorted(active)))
+            active.difference_update(ending[point])
+            self.between_points.append(
+                tuple(intervals[index][2] for index in sorted(active)))
+
+    def covers(self, when):
+        return self.span is None or self.span[0] <= when <= self.span[1]
+
+    def at(self, when):
+        """ Return the items active at ``when``. """
+        index = bisect.bisect_right(self.points, when) - 1
+        if index < 0:
+            return ()
+        if self.points[index] == when:
+            return self.at_points[index]
+        return self.between_points[index]
+
+
+WEEKDAYS = [
+    'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+    'sunday',
+]
+
+
+def parse_when(text, now):
+    """ Return the naive UTC datetime meant by ``text``.
+
+    Understands 'now', 'today', 'tomorrow', weekday names (optionally after
+    'next'), 'YYYY-MM-DD' and 'YYYY-MM-DD HH:MM'.  Days without a time mean
+    their noon.  Raises ValueError for anything else.
+    """
+    text = ' '.join(text.lower().split())
+    noon = now.replace(hour=12, minute=0, second=0, microsecond=0)
+    if text in ('', 'now'):
+        return now
+    if text == 'today':
+        return noon
+    if text == 'tomorrow':
+        return noon + datetime.timedelta(days=1)
+    if text.startswith('next '):
+        text = text[len('next '):]
+    if text in WEEKDAYS:
+        days = (WEEKDAYS.index(text) - now.weekday() - 1) % 7 + 1
+        return noon + datetime.timedelta(days=days)
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M')
+    except ValueError:
+        pass
+    return datetime.datetime.strptime(text, '%Y-%m-%d').replace(hour=12)
+
+
+def as_bool(value):
+    """ Return the boolean meant by a configuration ``value``. """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def byte_length(text):
+    """ Return how many bytes ``text`` takes on the wire. """
+    if isinstance(text, unicode):
+        return len(text.encode('utf-8'))
+    return len(text)
+
+
+def line_budget(nick, target):
+    """ Return how many bytes of text fit in a message ``nick`` sends to
+    ``target``, once the server prepended its hostmask to it.
+    """
+    overhead = byte_length(' PRIVMSG %s :\r\n' % target)
+    return IRC_LINE_LENGTH - HOSTMASK_LENGTH - len(nick) - overhead
+
+
+def wrap(text, limit):
+    """ Split ``text`` between its words into lines of at most ``limit``
+    bytes, a word too long for a line is cut.
+    """
+    if byte_length(text) <= limit:
+        yield text
+        return
+    words, length = [], 0
+    for word in text.split(' '):
+        while byte_length(word) > limit:
+            if words:
+                yield ' '.join(words)
+                words, length = [], 0
+            cut = limit
+            while byte_length(word[:cut]) > limit:
+                cut -= 1
+            yield word[:cut]
+            word = word[cut:]
+        size = byte_length(word)
+        if words and length + 1 + size <= limit:
+            words.append(word)
+            length += 1 + size
+        else:
+            if words:
+                yield ' '.join(words)
+            words, length = [word], size
+    if words:
+        yield ' '.join(words)
+
+
+def pack(parts, limit, separator=' | '):
+    """ Join ``parts`` into as few lines of at most ``limit`` bytes as
+    possible, a part too long for a line is wrapped.
+    """
+    pieces, length = [], 0
+    for part in parts:
+        for chunk in wrap(part, limit):
+            size = byte_length(chunk)
+            if pieces and length + len(separator) + size <= limit:
+                pieces.append(chunk)
+                length += len(separator) + size
+            else:
+                if pieces:
+                    yield separator.join(pieces)
+                pieces, length = [chunk], size
+    if pieces:
+        yield separator.join(pieces)
+
+
+CHEAP = 'cheap'
+NORMAL = 'normal'
+EXPENSIVE = 'expensive'
+
+
+def cheap(func):
+    """ Mark a command as cheap: it answers from what we have at hand,
+    never waiting on an upstream service.
+
+    The scheduler starts cheap commands right away, whatever else is
+    running or waiting.  It must be applied below ``@threaded`` or
+    ``@task``.
+    """
+    func.cost = CHEAP
+    return func
+
+
+def expensive(func):
+    """ Mark a command as expensive: many upstream calls, or slow ones.
+
+    The scheduler only runs a few expensive commands at once and lets the
+    others go first.  It must be applied below ``@threaded`` or ``@task``.
+    """
+    func.cost = EXPENSIVE
+    return func
+
+
+class FairQueue(object):
+    """ A queue served round robin over channels, then over the users of
+    each channel, so nobody can starve everybody else.
+    """
+
+    def __init__(self):
+        self.channels = collections.OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, channel, user, item):
+        users = self.channels.setdefault(channel, collections.OrderedDict())
+        users.setdefault(user, collections.deque()).append(item)
+        self.size += 1
+
+    def pop(self):
+        """ Return the next item, its channel and user go last in line. """
+        channel, users = self.channels.popitem(last=False)
+        user, items = users.popitem(last=False)
+        item = items.popleft()
+        if items:
+            users[user] = items
+        if users:
+            self.channels[channel] = users
+        self.size -= 1
+        return item
+
+
+class Scheduler(object):
+    """ Start the commands fairly and within limits.
+
+    Cheap commands start right away, they are never queued nor refused.
+    Of the others, at most ``limit`` run at once, of which at most
+    ``expensive_limit`` expensive ones, and normal commands go first.  Each
+    of these cost classes is a FairQueue, holding at most ``high_water``
+    pending commands, respectively ``expensive_high_water``: past that,
+    they would be answered too late to be of any use and are refused.  The
+    scheduler lives on the event loop.
+    """
+
+    def __init__(self, limit=8, expensive_limit=2,
+                 high_water=32, expensive_high_water=4):
+        self.limit = limit
+        self.expensive_limit = expensive_limit
+        self.high_water = {NORMAL: high_water, EXPENSIVE: expensive_high_water}
+        self.running = {CHEAP: 0, NORMAL: 0, EXPENSIVE: 0}
+        self.queues = {NORMAL: FairQueue(), EXPENSIVE: FairQueue()}
+        self.refused = 0
+
+    def stats(self):
+        return 'scheduler: %d running, %d pending, %d refused' % (
+            sum(self.running.values()),
+            sum(len(queue) for queue in self.queues.values()),
+            self.refused)
+
+    def submit(self, channel, user, cost, start):
+        """ Queue ``start``, called once it is its turn to run, it must
+        return the future of the command.
+
+        Return False, without queueing it, when there is too much pending
+        work already.
+        """
+        if cost == CHEAP:
+            self._start(cost, start)
+            return True
+        if len(self.queues[cost]) >= self.high_water[cost]:
+            self.refused += 1
+            return False
+        self.queues[cost].push(channel, user, start)
+        self._pump()
+        return True
+
+    def _pump(self):
+        while self.running[NORMAL] + self.running[EXPENSIVE] < self.limit:
+            if self.queues[NORMAL]:
+                cost = NORMAL
+            elif (self.queues[EXPENSIVE] and
+                    self.running[EXPENSIVE] < self.expensive_limit):
+                cost = EXPENSIVE
+            else:
+                break
+            self._start(cost, self.queues[cost].pop())
+
+    def _start(self, cost, start):
+        self.running[cost] += 1
+        try:
+            future = start()
+        except Exception:
+            self.running[cost] -= 1
+            raise
+        future.add_done_callback(functools.partial(self._done, cost))
+
+    def _done(self, cost, future):
+        self.running[cost] -= 1
+        if cost != CHEAP:
+            self._pump()
+
+
+class Outbox(object):
+    """ Send the lines no faster than the server tolerates: up to ``burst``
+    lines right away, then one every ``interval`` seconds.  The targets
+    waiting for their lines are served round robin, so a long answer in
+    one channel does not hold the others back.  The outbox lives on the
+    event loop.
+    """
+
+    def __init__(self, loop, send, burst=4, interval=1.0):
+        self.loop = loop
+        self.send = send
+        self.burst = burst
+        self.interval = interval
+        self.tokens = burst
+        self.updated = loop.time()
+        self.queue = FairQueue()
+        self.handle = None
+
+    def extend(self, target, lines):
+        """ Queue ``lines`` to be sent to ``target``. """
+        for line in lines:
+            self.queue.push(target, None, (target, line))
+        self._drain()
+
+    def _tick(self):
+        self.handle = None
+        self._drain()
+
+    def _drain(self):
+        now = self.loop.time()
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+        while self.queue and self.tokens >= 1:
+            self.send(*self.queue.pop())
+            self.tokens -= 1
+        if self.queue and self.handle is None:
+            self.handle = self.loop.call_later(
+                (1 - self.tokens) * self.interval, self._tick)
+
+
+class Cursors(object):
+    """ The rest of the long answers, per channel and user, until they ask
+    for it with the ``more`` command or ``ttl`` seconds went by.
+
+    The answers are iterators, only the items which are shown are ever
+    produced.
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.cursors = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cursors)
+
+    def _expire(self, now):
+        for key, cursor in list(self.cursors.items()):
+            if cursor[0] <= now:
+                del self.cursors[key]
+
+    def open(self, key, items, render):
+        """ Keep the iterable ``items`` for ``key``, instead of what was
+        kept for it before.  ``render(page, number)`` turns a page of them
+        into a message.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            self.cursors[key] = (now + self.ttl, render, 0, [], iter(items))
+
+    def take(self, key, size):
+        """ Return the next ``size`` items kept for ``key``, rendered, and
+        whether there are more, or None if nothing is kept for it.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            if key not in self.cursors:
+                return None
+            _, render, number, head, items = self.cursors.pop(key)
+            page = head + list(islice(items, size + 1 - len(head)))
+            head = page[size:]
+            del page[size:]
+            if head:
+                self.cursors[key] = (
+                    now + self.ttl, render, number + 1, head, items)
+            return render(page, number + 1), bool(head)
+
+
+def task(func):
+    """ Run the body of a command as a coroutine on the event loop.
+
+    This is for the commands which only wait on the upstream web services:
+    they do so through the plugin's HTTPClient without tying up a thread,
+    and for the cheap ones.  Like ``threaded``, it must be applied below
+    ``@command``.
+    """
+    func = asyncio.coroutine(func)
+
+    @functools.wraps(func)
+    def wrapper(self, mask, target, args):
+        self.schedule(func, mask, target, args)
+
+    return wrapper
+
+
+def threaded(func):
+    """ Run the body of a command in the plugin's executor.
+
+    Commands talking to FAS or pkgdb through their (blocking) clients block
+    for as long as the remote end takes to answer.  Decorating them with this
+    keeps the event loop (and thus PINGs and every other command) responsive
+    while they wait.  It must be applied below ``@command`` so the name and
+    docstring seen by irc3 are the ones of the original method.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, mask, target, args):
+        self.dispatch(func, mask, target, args)
+
+    return wrapper
 
 
 @irc3.plugin
@@ -130,6 +1829,44 @@ class FedoraPlugin:
 
     def __init__(self, bot):
         self.bot = bot
+        self.log = logging.getLogger('irc3.%s' % __name__)
+        self.config = bot.config.get(__name__, {})
+
+        workers = int(self.config.get('workers', 8))
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.scheduler = Scheduler(
+            limit=int(self.config.get('running_limit', workers)),
+            expensive_limit=int(self.config.get('expensive_limit', 2)),
+            high_water=int(self.config.get('high_water', 32)),
+            expensive_high_water=int(
+                self.config.get('expensive_high_water', 4)))
+        self.cursors = Cursors(
+            ttl=int(self.config.get('more_timeout', 600)))
+        self.outbox = Outbox(
+            self.bot.loop, self.bot.privmsg,
+            burst=int(self.config.get('output_burst', 4)),
+            interval=float(self.config.get('output_interval', 1)))
+
+        # Calls to FAS and pkgdb run in a pool of their own, so the command
+        # waiting on them can give up once past the deadline.  Services
+        # failing too often are not even called for a while.
+        self.upstream = ThreadPoolExecutor(max_workers=workers)
+        # The commands needing several of those calls at once make the
+        # others from this pool, they only wait on the upstream one.
+        self.fanout = ThreadPoolExecutor(max_workers=workers)
+        self.deadline = float(self.config.get('upstream_timeout', 10))
+        breaker = functools.partial(
+            CircuitBreaker,
+            threshold=int(self.config.get('breaker_threshold', 5)),
+            reset=float(self.config.get('breaker_reset', 60)))
+        self.breakers = dict(fas=breaker('FAS'), pkgdb=breaker('pkgdb'))
+
+        # Every other upstream service is queried without blocking.
+        self.http = HTTPClient(
+            bot.loop,
+            limit=int(self.config.get('http_limit', 8)),
+            timeout=float(self.config.get('http_timeout', 30)),
+            breaker=breaker)
 
         fas_url = bot.config['fas']['url']
         fas_username = bot.config['fas']['username']
@@ -137,55 +1874,601 @@ class FedoraPlugin:
         self.fasclient = AccountSystem(
             fas_url, username=fas_username, password=fas_password)
 
-        #self.log.info("Downloading package owners cache")
-        data = requests.get(
-            'https://admin.fedoraproject.org/pkgdb/api/bugzilla?format=json',
-            verify=True).json()
-        self.bugzacl = data['bugzillaAcls']
+        # Optionally, the caches below are also kept on disk so a restarted
+        # bot does not start cold.
+        # Several bots can also share them, and the package owners, through
+        # the CacheDaemon.
+        self.store = None
+        self.restored = set()
+        self.daemon = None
+        if self.config.get('cache_daemon'):
+            self.daemon = self.store = CacheClient(self.config['cache_daemon'])
+            # The cheap commands ask it from a pool of their own, which is
+            # never busy with upstream work.
+            self.nearby = ThreadPoolExecutor(max_workers=workers)
+        elif self.config.get('cache_store'):
+            self.store = SQLiteStore(self.config['cache_store'])
+        self.persons = TTLCache(
+            'persons',
+            maxsize=int(self.config.get('person_cache_size', 1024)),
+            ttl=int(self.config.get('person_cache_ttl', 600)),
+            stale=int(self.config.get('person_cache_stale', 86400)),
+            executor=self.executor,
+            store=self.store)
+        # The approved (group, role type) of the FAS accounts.
+        self.roles = TTLCache(
+            'roles',
+            maxsize=int(self.config.get('role_cache_size', 1024)),
+            ttl=int(self.config.get('role_cache_ttl', 600)),
+            stale=int(self.config.get('role_cache_stale', 86400)),
+            executor=self.executor,
+            store=self.store)
+        # Groups weigh as much as they have members, so the cache is capped
+        # to a number of usernames rather than a number of groups.
+        self.groups = TTLCache(
+            'groups',
+            maxsize=int(self.config.get('group_cache_size', 50000)),
+            ttl=int(self.config.get('group_cache_ttl', 3600)),
+            sizeof=lambda group: sum(len(role) for role in group) or 1,
+            stale=int(self.config.get('group_cache_stale', 86400)),
+            executor=self.executor,
+            store=self.store)
+        # The branches of the packages, they seldom change.
+        self.branch_lists = TTLCache(
+            'branches',
+            maxsize=int(self.config.get('branch_cache_size', 10000)),
+            ttl=int(self.config.get('branch_cache_ttl', 3600)),
+            stale=int(self.config.get('branch_cache_stale', 86400)),
+            executor=self.executor,
+            store=self.store)
+        # Number of messages per time window as returned by datagrepper.
+        # Only the windows which are over are cached, they never change.
+        self.counts = TTLCache(
+            'counts',
+            maxsize=int(self.config.get('count_cache_size', 10000)),
+            ttl=int(self.config.get('count_cache_ttl', 7 * 24 * 3600)),
+            store=self.store)
+        self.caches = [
+            self.persons, self.roles, self.groups, self.branch_lists,
+            self.counts, self.http]
+
+        # The package owners are read from the last snapshot we saved, if
+        # any, then refreshed from pkgdb, both in the background so neither
+        # a large snapshot nor a slow pkgdb keeps us from connecting.  Until
+        # then, commands answer ACL_LOADING.  Refreshes replace
+        # self.packages as a whole.
+        # With a CacheDaemon, it does all that and we only query it.
+        self.refreshes = {}
+        self.acl_snapshot = self.config.get('acl_snapshot')
+        self.acl_refresh = int(self.config.get('acl_refresh', 3600))
+        self.acl_timeout = float(self.config.get('acl_timeout', 300))
+        self.acl_refresh_delay = int(
+            self.config.get('acl_refresh_delay', 600))
+        if self.daemon is not None:
+            self.packages = RemotePackageIndex(self.daemon)
+        else:
+            self.packages = PackageIndex()
+            self.bot.loop.call_soon(
+                self.refresh, 'packages', self._download_acls,
+                self.acl_refresh)
+
+        # Same for the meetings of every IRC channel, fetched concurrently.
+        self.meetings = self._restore('meetings')
+        self.calendars = self._restore('calendars')
+        self.bot.loop.call_soon(
+            self.refresh, 'calendars', self._fetch_calendars,
+            int(self.config.get('calendar_refresh', 600)))
+        self.bot.loop.call_soon(
+            self.refresh, 'meetings', self._fetch_meetings,
+            int(self.config.get('meeting_refresh', 600)))
+
+        # A few minutes before a meeting starts in a channel we are in, the
+        # people there are looked up so the roll call is answered from
+        # memory.  Who is in the channels is kept by irc3.plugins.userlist.
+        # They are looked up one at a time, as expensive commands of ours,
+        # so the commands of the users go first.
+        self.prewarm_before = int(self.config.get('prewarm_before', 300))
+        self.prewarm_limit = int(self.config.get('prewarm_limit', 50))
+        self.prewarmed = set()
+        if self.prewarm_before:
+            self.bot.loop.call_soon(self._prewarm)
 
         self.pkgdb = PkgDB()
 
         # Pull in /etc/fedmsg.d/ so we can build the fedmsg.meta processors.
         fm_config = fedmsg.config.load_config()
         fedmsg.meta.make_processors(**fm_config)
+        self.fm_config = fm_config
+
+        # Optionally follow the bus ourselves to count the messages per
+        # category, quote then only asks datagrepper about older history.
+        self.histogram = None
+        self.bus_handlers = []
+        if as_bool(self.config.get('bus', False)):
+            self._follow_bus()
+
+    def _follow_bus(self):
+        self.histogram = Histogram(
+            size=int(float(self.config.get('bus_history', 14)) *
+                     24 * 3600 / HISTOGRAM_RESOLUTION))
+        self.bus_handlers.append(self._count_message)
+        self.bus_handlers.append(self._invalidate)
+        bus_config = dict(self.fm_config, mute=True)
+        if self.config.get('bus_endpoints'):
+            bus_config['endpoints'] = {
+                'irc3fedora': self.config['bus_endpoints'].split()}
+        self.bus = BusListener(bus_config, self.bus_handlers)
+        self.bus.start()
+
+    def refresh(self, attribute, fetch, interval):
+        """ Set ``attribute`` to what the coroutine ``fetch`` returns, now
+        and then every ``interval`` seconds.
+
+        The attribute is replaced as a whole from the event loop, commands
+        see either the previous value or the new one, never a mix of both.
+        """
+        self.refreshes.pop(attribute, None)
+        future = self.bot.loop.create_task(fetch())
+        future.add_done_callback(functools.partial(
+            self._refreshed, attribute, fetch, interval))
+
+    def _refreshed(self, attribute, fetch, interval, future):
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is None:
+            setattr(self, attribute, future.result())
+            if attribute in self.restored:
+                self.bot.loop.run_in_executor(
+                    self.executor, self.store.set, 'refreshed', attribute,
+                    time.time(), future.result())
+        else:
+            self.log.error('Could not refresh %s: %r', attribute, exc)
+        handle = self.bot.loop.call_later(
+            interval, self.refresh, attribute, fetch, interval)
+        self.refreshes[attribute] = (handle, fetch, interval, False)
+
+    def _restore(self, attribute):
+        """ Return what ``attribute`` was last refreshed to, if stored, and
+        store it from now on.
+        """
+        if self.store is None:
+            return None
+        self.restored.add(attribute)
+        try:
+            _, value, _ = self.store.get('refreshed', attribute)
+        except KeyError:
+            return None
+        return value
+
+    def refresh_soon(self, attribute, delay):
+        """ Refresh ``attribute`` in ``delay`` seconds, unless that is
+        planned already or it is being refreshed right now.
+        """
+        if attribute not in self.refreshes:
+            return
+        handle, fetch, interval, early = self.refreshes[attribute]
+        if early:
+            return
+        handle.cancel()
+        handle = self.bot.loop.call_later(
+            delay, self.refresh, attribute, fetch, interval)
+        self.refreshes[attribute] = (handle, fetch, interval, True)
+
+    def _prewarm(self):
+        """ Warm the caches for the channels with a meeting starting soon,
+        then check again in a minute.
+        """
+        self.bot.loop.call_later(60, self._prewarm)
+        channels = getattr(self.bot, 'channels', None)
+        if self.meetings is None or not channels:
+            return
 
-    @staticmethod
-    def _future_meetings(location):
-        if not location.endswith('@irc.freenode.net'):
-            location = '%s@irc.freenode.net' % location
-        meetings = FedoraPlugin._query_fedocal(location=location)
         now = datetime.datetime.utcnow()
+        soon = now + datetime.timedelta(seconds=self.prewarm_before)
+        self.prewarmed = set(
+            meeting for meeting in self.prewarmed if meeting[1] > now)
+        for channel, nicks in list(channels.items()):
+            location = '%s@irc.freenode.net' % channel.lstrip('#')
+            for start, _ in islice(self.meetings.upcoming(location, now), 1):
+                if start <= soon and (location, start) not in self.prewarmed:
+                    self.prewarmed.add((location, start))
+                    self._warm(channel, list(islice(
+                        (nick for nick in nicks if nick != self.bot.nick),
+                        self.prewarm_limit)))
+
+    def _warm(self, channel, nicks):
+        """ Queue the lookup of the first of ``nicks`` with the scheduler,
+        the next one is queued once it is done.  Give up when the scheduler
+        is too busy, or FAS is not answering.
+        """
+        if not nicks:
+            return
 
-        for meeting in meetings:
-            string = "%s %s" % (meeting['meeting_date'],
-                                meeting['meeting_time_start'])
-            dt = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
+        def started():
+            future = self.bot.loop.run_in_executor(
+                self.executor, self._warm_one, nicks[0])
+            future.add_done_callback(next_one)
+            return future
 
-            if now < dt:
-                yield dt, meeting
+        def next_one(future):
+            if not future.cancelled() and future.result():
+                self._warm(channel, nicks[1:])
 
-    @staticmethod
-    def _meetings_for(calendar):
-        meetings = FedoraPlugin._query_fedocal(calendar=calendar)
-        now = datetime.datetime.utcnow()
+        self.scheduler.submit(channel, self.bot.nick, EXPENSIVE, started)
+
+    def _warm_one(self, nick):
+        """ Look up the FAS account and roles of ``nick``, return False if
+        FAS is not answering.
+        """
+        try:
+            self._person(nick)
+            self._roles(nick)
+        except Unavailable:
+            return False
+        except Exception as error:
+            self.log.debug('Could not prewarm %s: %r', nick, error)
+        return True
+
+    @asyncio.coroutine
+    def _ask_packages(self, question):
+        """ Return what ``question`` answers given the package index, raise
+        Unavailable while it is empty.
+
+        Ours is asked right away.  The index of the CacheDaemon is asked
+        from the ``nearby`` pool, each of its methods is a round trip to the
+        daemon.
+        """
+        def ask():
+            packages = self.packages
+            if not packages:
+                raise Unavailable('the package list')
+            return question(packages)
+
+        if self.daemon is None:
+            raise Return(ask())
+        answer = yield From(self.bot.loop.run_in_executor(self.nearby, ask))
+        raise Return(answer)
+
+    @asyncio.coroutine
+    def _download_acls(self):
+        """ Return the PackageIndex of the ACLs pkgdb answers.
+
+        The first time, the snapshot is loaded first, in the executor, and
+        used until pkgdb answers.
+        """
+        if not self.packages:
+            snapshot = yield From(self.bot.loop.run_in_executor(
+                self.executor, load_acls, self.acl_snapshot))
+            if not self.packages:
+                self.packages = snapshot
+        packages = yield From(download_acls(
+            self.bot.loop, self.http, self.executor, self.acl_timeout,
+            self.packages, self.acl_snapshot))
+        raise Return(packages)
+
+    @asyncio.coroutine
+    def _fetch_meetings(self):
+        """ Return a MeetingIndex of the meetings of every IRC channel. """
+        url = 'https://apps.fedoraproject.org/calendar/api/locations/'
+        data = yield From(self.http.get_json(url))
+        locations = [
+            location for location in data['locations']
+            if 'irc.freenode.net' in location
+        ]
+        meetings = yield From(asyncio.gather(
+            *[self._meetings_at(location) for location in locations],
+            loop=self.bot.loop))
+        raise Return(MeetingIndex(zip(locations, meetings)))
+
+    def reply(self, mask, target, *parts):
+        """ Send ``parts`` to ``target``, addressed to ``mask.nick``, in as
+        few lines as the server accepts.
+
+        This is safe to call from the executor threads: the lines are
+        handed back to the event loop, which queues them in the outbox.
+        """
+        prefix = '%s: ' % mask.nick
+        limit = line_budget(self.bot.nick, target) - byte_length(prefix)
+        lines = [prefix + line for line in pack(parts, limit)]
+        self.bot.loop.call_soon_threadsafe(self.outbox.extend, target, lines)
+
+    def paginate(self, mask, target, items, render):
+        """ Reply the first page of ``items``, rendered by ``render``, and
+        keep the rest for the ``more`` command.
+        """
+        self.cursors.open((target, mask.nick), items, render)
+        self._next_page(mask, target)
+
+    def _next_page(self, mask, target):
+        page = self.cursors.take((target, mask.nick), PAGE_SIZE)
+        if page is None:
+            self.reply(mask, target, 'There is nothing more to show.')
+            return
+        msg, more = page
+        if more:
+            cmd = self.bot.config.get('irc3.plugins.command', {}).get(
+                'cmd', '!')
+            msg = '%s (%smore for the next page)' % (msg, cmd)
+        self.reply(mask, target, msg)
+
+    def dispatch(self, func, mask, target, args):
+        """ Queue the command ``func``, to run in the executor. """
+        self._submit(func, mask, target, functools.partial(
+            self.bot.loop.run_in_executor,
+            self.executor, func, self, mask, target, args))
+
+    def schedule(self, func, mask, target, args):
+        """ Queue the coroutine command ``func``, to run on the loop. """
+        self._submit(func, mask, target, lambda: self.bot.loop.create_task(
+            func(self, mask, target, args)))
+
+    def _submit(self, func, mask, target, start):
+        def started():
+            future = start()
+            future.add_done_callback(functools.partial(
+                self._dispatched, func.__name__, mask, target))
+            return future
+
+        cost = getattr(func, 'cost', NORMAL)
+        if not self.scheduler.submit(target, mask.nick, cost, started):
+            self.reply(mask, target, 'Sorry, I am busy, please try again '
+                       'in a few minutes.')
+
+    def _dispatched(self, name, mask, target, future):
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if isinstance(exc, Unavailable):
+            msg = 'Sorry, %s, please try again later.' % exc
+            self.reply(mask, target, msg)
+        elif isinstance(exc, HTTPError):
+            msg = 'Sorry, %s.' % exc
+            self.reply(mask, target, msg)
+        elif exc is not None:
+            self.log.error('Command %r failed: %r', name, exc)
+
+    def _call(self, service, func, *args, **kwargs):
+        """ Call ``func`` of the blocking client of ``service`` (fas or
+        pkgdb) and return what it returns.
+
+        Raise Unavailable if the service does not answer within the
+        deadline, or if it failed too often lately.
+        """
+        breaker = self.breakers[service]
+        breaker.allow()
+        future = self.upstream.submit(func, *args, **kwargs)
+        try:
+            result = future.result(timeout=self.deadline)
+        except FutureTimeoutError:
+            breaker.failure()
+            raise Unavailable(breaker.service)
+        except AppError:
+            # The service answered, just not what we hoped for.
+            breaker.success()
+            raise
+        except Exception:
+            breaker.failure()
+            raise
+        breaker.success()
+        return result
+
+    def _person(self, username):
+        """ Return the FAS account of ``username``, from the cache if we
+        looked it up recently.
+        """
+        return self.persons.fetch(username, functools.partial(
+            self._call, 'fas', self.fasclient.person_by_username, username))
+
+    def _people(self, names):
+        """ Return the (name, person) of the FAS accounts ``names``, looked
+        up at once.  ``person`` is None if there is no such account, or the
+        exception raised while looking it up.
+
+        Raise Unavailable if FAS is not answering, rather than telling it
+        for each of them.
+        """
+        futures = [
+            (name, self.fanout.submit(self._person, name))
+            for name in collections.OrderedDict.fromkeys(names)]
+        people = []
+        for name, future in futures:
+            try:
+                people.append((name, future.result()))
+            except Exception as error:
+                people.append((name, error))
+        for _, person in people:
+            if isinstance(person, Unavailable):
+                raise person
+        return people
+
+    def _localtime(self, name, person, now):
+        """ Return what time ``now`` is for ``person``, as a message. """
+        if isinstance(person, Exception):
+            return 'Error getting info user user: "%s"' % name
+
+        if not person:
+            return 'User "%s" doesn\'t exist' % name
+
+        timezone_name = person['timezone']
+        if timezone_name is None:
+            return 'User "%s" doesn\'t share his timezone' % name
+        try:
+            # pytz keeps the timezones it loaded, they are shared.
+            time = now.astimezone(pytz.timezone(timezone_name))
+        except:
+            return 'The timezone of "%s" was unknown: "%s"' % (
+                name, timezone_name)
+
+        return 'The current local time of "%s" is: "%s" (timezone: %s)' % (
+            name, time.strftime('%H:%M'), timezone_name)
+
+    def _roles(self, username):
+        """ Return the (group, role type) of the approved memberships of
+        ``username``, from the cache if we looked them up recently.
+        """
+        def query():
+            roles = self._call(
+                'fas', self.fasclient.people_query,
+                constraints={
+                    'username': username, 'group': '%',
+                    'role_status': 'approved'},
+                columns=['username', 'group', 'role_type'])
+            return tuple((role['group'], role['role_type']) for role in roles)
+
+        return self.roles.fetch(username, query)
+
+    def _group_members(self, name):
+        """ Return the GroupMembers of the FAS group ``name``. """
+        return self.groups.fetch(name, lambda: split_group_members(
+            self._call('fas', self.fasclient.group_members, name)))
+
+    def _invalidate(self, topic, msg):
+        """ Forget the cached FAS accounts, groups and package branches the
+        bus message ``msg`` is about, the next commands will look them up
+        again.
+        """
+        service = msg.get('topic', topic).split('.')[3]
+        if service == 'fas':
+            usernames = fedmsg.meta.msg2usernames(msg, **self.fm_config)
+            for username in usernames:
+                self.persons.invalidate(username)
+                self.roles.invalidate(username)
+            group = msg.get('msg', {}).get('group')
+            if group:
+                self.groups.invalidate(group)
+        elif service == 'pkgdb':
+            packages = fedmsg.meta.msg2packages(msg, **self.fm_config)
+            for package in packages:
+                self.branch_lists.invalidate(package)
+            # Downloading the owners of every package is costly, all the
+            # changes made until then are picked up at once.
+            self.bot.loop.call_soon_threadsafe(
+                self.refresh_soon, 'packages', self.acl_refresh_delay)
+
+    def _count_message(self, topic, msg):
+        category = msg.get('topic', topic).split('.')[3]
+        self.histogram.record(category, msg.get('timestamp', time.time()))
+
+    @asyncio.coroutine
+    def _count(self, query):
+        """ Return the number of messages matching the datagrepper
+        ``query``, from the bus histogram if it covers its time window, else
+        from the cache if that window is over.
+        """
+        if self.histogram is not None:
+            counts = [
+                self.histogram.count(category, query['start'], query['end'])
+                for category in query['category']
+            ]
+            if None not in counts:
+                raise Return(sum(counts))
+
+        over = query['end'] <= datetime.datetime.utcnow()
+        key = (tuple(query['category']), query['start'], query['end'])
+        # The counts may be in the store, which is not read on the loop.
+        if over:
+            try:
+                count = yield From(self.bot.loop.run_in_executor(
+                    self.executor, self.counts.get, key))
+            except KeyError:
+                pass
+            else:
+                raise Return(count)
+
+        count = yield From(datagrepper_query(self.http, dict(query)))
+        if over:
+            self.bot.loop.run_in_executor(
+                self.executor, self.counts.set, key, count)
+        raise Return(count)
+
+    @asyncio.coroutine
+    def _meetings_at(self, location):
+        """ Return the (start, meeting) of the meetings at ``location``. """
+        if not location.endswith('@irc.freenode.net'):
+            location = '%s@irc.freenode.net' % location
+        meetings = yield From(self._query_fedocal(location=location))
 
+        result = []
         for meeting in meetings:
             string = "%s %s" % (meeting['meeting_date'],
                                 meeting['meeting_time_start'])
-            start = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
-            string = "%s %s" % (meeting['meeting_date_end'],
-                                meeting['meeting_time_stop'])
-            end = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
+            dt = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
+            result.append((dt, meeting))
+        raise Return(result)
 
-            if now >= start and now <= end:
-                yield meeting
+    @asyncio.coroutine
+    def _future_meetings(self, location):
+        now = datetime.datetime.utcnow()
+        meetings = yield From(self._meetings_at(location))
+        raise Return([
+            (dt, meeting) for dt, meeting in meetings if now < dt])
+
+    @asyncio.coroutine
+    def _calendar(self, calendar, when=None):
+        """ Return an IntervalIndex of the meetings of ``calendar`` around
+        ``when``.
+        """
+        when = when or datetime.datetime.utcnow()
+        span = (when - CALENDAR_PAST, when + CALENDAR_FUTURE)
+        meetings = yield From(self._query_fedocal(
+            calendar=calendar,
+            start=span[0].strftime('%Y-%m-%d'),
+            end=span[1].strftime('%Y-%m-%d'),
+        ))
+
+        def intervals():
+            for meeting in meetings:
+                string = "%s %s" % (meeting['meeting_date'],
+                                    meeting['meeting_time_start'])
+                start = datetime.datetime.strptime(
+                    string, "%Y-%m-%d %H:%M:%S")
+                string = "%s %s" % (meeting['meeting_date_end'],
+                                    meeting['meeting_time_stop'])
+                end = datetime.datetime.strptime(string, "%Y-%m-%d %H:%M:%S")
+                yield start, end, meeting
+
+        # Days are what fedocal deals with, trim the span to whole ones.
+        span = (
+            datetime.datetime.combine(span[0].date(), datetime.time()),
+            datetime.datetime.combine(span[1].date(), datetime.time()),
+        )
+        raise Return(IntervalIndex(intervals(), span))
+
+    @asyncio.coroutine
+    def _fetch_calendars(self):
+        indexes = yield From(asyncio.gather(
+            *[self._calendar(calendar) for calendar in CALENDARS],
+            loop=self.bot.loop))
+        raise Return(dict(zip(CALENDARS, indexes)))
+
+    @asyncio.coroutine
+    def _meetings_for(self, calendar, when=None):
+        """ Return the meetings of ``calendar`` happening at ``when``. """
+        when = when or datetime.datetime.utcnow()
+        index = (self.calendars or {}).get(calendar)
+        if index is None or not index.covers(when):
+            index = yield From(self._calendar(calendar, when))
+        raise Return(index.at(when))
 
     @staticmethod
-    def _query_fedocal(**kwargs):
+    def _when(words):
+        """ Return the datetime meant by the command arguments ``words``
+        (None meaning now) and how to say it.
+        """
+        if not words:
+            return None, 'right now'
+        when = parse_when(' '.join(words), datetime.datetime.utcnow())
+        return when, 'on %s' % when.strftime('%Y-%m-%d %H:%M UTC')
+
+    @asyncio.coroutine
+    def _query_fedocal(self, **kwargs):
         url = 'https://apps.fedoraproject.org/calendar/api/meetings'
-        return requests.get(url, params=kwargs).json()['meetings']
+        data = yield From(self.http.get_json(url, **kwargs))
+        raise Return(data['meetings'])
 
     @command
+    @threaded
     def admins(self, mask, target, args):
         """admins <group name>
 
@@ -197,19 +2480,17 @@ class FedoraPlugin:
 
         msg = None
         try:
-            group = self.fasclient.group_members(name)
-            sponsors = ''
-            for person in group:
-                if person['role_type'] == 'administrator':
-                    sponsors += person['username'] + ' '
-            msg = 'Administrators for %s: %s' % (name, sponsors)
+            group = self._group_members(name)
+            msg = 'Administrators for %s: %s' % (
+                name, ' '.join(group.administrators))
         except AppError:
             msg = 'There is no group %s.' % name
 
         if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
 
     @command
+    @task
     def badges(self, mask, target, args):
         """badges <username>
 
@@ -220,7 +2501,7 @@ class FedoraPlugin:
         name = args['<username>']
 
         url = "https://badges.fedoraproject.org/user/" + name
-        d = requests.get(url + "/json").json()
+        d = yield From(self.http.get_json(url + "/json", accept_errors=True))
 
         if 'error' in d:
             response = d['error']
@@ -229,9 +2510,10 @@ class FedoraPlugin:
             n = len(d['assertions'])
             response = template.format(name=name, url=url, n=n)
 
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+        self.reply(mask, target, response)
 
     @command
+    @threaded
     def branches(self, mask, target, args):
         """branches <package>
 
@@ -241,21 +2523,38 @@ class FedoraPlugin:
         """
         package = args['<package>']
 
+        def query():
+            pkginfo = self._call('pkgdb', self.pkgdb.get_package, package)
+            return tuple(sorted(
+                listing['collection']['branchname']
+                for listing in pkginfo['packages']))
+
         try:
-            pkginfo = self.pkgdb.get_package(package)
+            branch_list = self.branch_lists.fetch(package, query)
         except AppError:
             msg = "No such package exists."
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
             return
 
-        branch_list = []
-        for listing in pkginfo['packages']:
-            branch_list.append(listing['collection']['branchname'])
-        branch_list.sort()
-        msg = ' '.join(branch_list)
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        self.paginate(
+            mask, target, branch_list, lambda page, number: ' '.join(page))
 
     @command
+    def cachestats(self, mask, target, args):
+        """cachestats
+
+        Return the hit, miss and eviction counters of the bot's caches, how
+        many upstream calls were saved by sharing identical ones and how
+        many commands are running, pending or were refused.
+
+            %%cachestats
+        """
+        msg = ', '.join(
+            item.stats() for item in self.caches + [self.scheduler])
+        self.reply(mask, target, msg)
+
+    @command
+    @threaded
     def fas(self, mask, target, args):
         """fas <pattern>
 
@@ -263,7 +2562,8 @@ class FedoraPlugin:
 
             %%fas <pattern>
         """
-        users = self.fasclient.people_query(
+        users = self._call(
+                'fas', self.fasclient.people_query,
                 constraints={
                     #'username': args['<pattern>'],
                     'ircnick': args['<pattern>'],
@@ -279,9 +2579,10 @@ class FedoraPlugin:
             )
         else:
             msg = 'No user matching found'
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        self.reply(mask, target, msg)
 
     @command
+    @threaded
     def fasinfo(self, mask, target, args):
         """fasinfo <pattern>
 
@@ -291,64 +2592,58 @@ class FedoraPlugin:
         """
         name = args['<username>']
 
+        # Both queries go to FAS at once, the person is shown without
+        # waiting for its groups.
+        roles = self.fanout.submit(self._roles, name)
         try:
-            person = self.fasclient.person_by_username(name)
-        except:
+            person = self._person(name)
+        except Unavailable:
+            raise
+        except Exception:
             msg = 'Error getting info for user: "%s"' % name
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
             return
 
         if not person:
             msg = 'User "%s" doesn\'t exist' % name
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
             return
 
-        person['creation'] = person['creation'].split(' ')[0]
+        # The person is shared with the cache, do not modify it in place.
+        person = dict(person, creation=person['creation'].split(' ')[0])
         string = (
             "User: %(username)s, Name: %(human_name)s"
             ", email: %(email)s, Creation: %(creation)s"
             ", IRC Nick: %(ircnick)s, Timezone: %(timezone)s"
             ", Locale: %(locale)s"
             ", GPG key ID: %(gpg_keyid)s, Status: %(status)s") % person
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, string))
+        self.reply(mask, target, string)
 
         # List of unapproved groups is easy
-        unapproved = ''
-        for group in person['unapproved_memberships']:
-            unapproved = unapproved + "%s " % group['name']
-        if unapproved != '':
+        unapproved = ' '.join(
+            group['name'] for group in person['unapproved_memberships'])
+        if unapproved:
             msg = 'Unapproved Groups: %s' % unapproved
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
 
         # List of approved groups requires a separate query to extract roles
-        constraints = {
-            'username': name, 'group': '%',
-            'role_status': 'approved'}
-        columns = ['username', 'group', 'role_type']
-        roles = []
-        try:
-            roles = self.fasclient.people_query(
-                constraints=constraints,
-                columns=columns)
-        except:
+        try:
+            roles = roles.result()
+        except Unavailable:
+            raise
+        except Exception:
             msg = 'Error getting group memberships.'
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
             return
 
-        approved = ''
-        for role in roles:
-            if role['role_type'] == 'sponsor':
-                approved += '+' + role['group'] + ' '
-            elif role['role_type'] == 'administrator':
-                approved += '@' + role['group'] + ' '
-            else:
-                approved += role['group'] + ' '
-        if approved == '':
-            approved = "None"
-        msg = 'Approved Groups: %s' % approved
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        prefixes = {'sponsor': '+', 'administrator': '@'}
+        approved = ' '.join(
+            prefixes.get(role_type, '') + group for group, role_type in roles)
+        msg = 'Approved Groups: %s' % (approved or 'None')
+        self.reply(mask, target, msg)
 
     @command
+    @threaded
     def group(self, mask, target, args):
         """group <group short name>
 
@@ -360,38 +2655,44 @@ class FedoraPlugin:
 
         msg = None
         try:
-            group = self.fasclient.group_by_name(name)
+            group = self._call('fas', self.fasclient.group_by_name, name)
             msg = '%s: %s' % (name, group['display_name'])
         except AppError:
             msg = 'There is no group "%s".' % name
 
         if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
 
     @command
+    @threaded
+    @expensive
     def hellomynameis(self, mask, target, args):
-        """hellomynameis <username>
+        """hellomynameis <username>...
 
-        Return brief information about a Fedora Account System username. Useful
-        for things like meeting roll call and calling attention to yourself.
+        Return brief information about up to 30 Fedora Account System
+        usernames.  Useful for things like meeting roll call and calling
+        attention to yourself.
 
-            %%hellomynameis <username>
+            %%hellomynameis <username>...
         """
-        name = args['<username>']
-        msg = None
-        try:
-            person = self.fasclient.person_by_username(name)
-        except:
-            msg = 'Something blew up, please try again'
-        if not person:
-            msg = 'Sorry, but you don\'t exist'
-        else:
-            msg = '%(username)s \'%(human_name)s\' <%(email)s>' % person
+        if len(set(args['<username>'])) > MAX_USERNAMES:
+            self.reply(mask, target, TOO_MANY_USERNAMES)
+            return
 
-        if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        parts = []
+        for name, person in self._people(args['<username>']):
+            if isinstance(person, Exception):
+                parts.append(
+                    'Something blew up for %s, please try again' % name)
+            elif not person:
+                parts.append('Sorry, but %s doesn\'t exist' % name)
+            else:
+                parts.append(
+                    '%(username)s \'%(human_name)s\' <%(email)s>' % person)
+        self.reply(mask, target, *parts)
 
     @command
+    @threaded
     def himynameis(self, mask, target, args):
         """himynameis <username>
 
@@ -400,60 +2701,43 @@ class FedoraPlugin:
             %%himynameis <username>
         """
         name = args['<username>']
-        msg = None
+        person = None
         try:
-            person = self.fasclient.person_by_username(name)
-        except:
+            person = self._person(name)
+        except Unavailable:
+            raise
+        except Exception:
             msg = 'Something blew up, please try again'
-        if not person:
-            msg = 'Sorry, but you don\'t exist'
         else:
-            msg = '%(username)s \'Slim Shady\' <%(email)s>' % person
+            if not person:
+                msg = 'Sorry, but you don\'t exist'
+            else:
+                msg = '%(username)s \'Slim Shady\' <%(email)s>' % person
 
-        if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        self.reply(mask, target, msg)
 
     @command
+    @threaded
+    @expensive
     def localtime(self, mask, target, args):
-        """localtime <username>
+        """localtime <username>...
 
-        Returns the current time of the user.
+        Returns the current time of the users, up to 30 of them.
         The timezone is queried from FAS.
 
-            %%localtime <username>
+            %%localtime <username>...
         """
-        name = args['<username>']
-
-        try:
-            person = self.fasclient.person_by_username(name)
-        except:
-            msg = 'Error getting info user user: "%s"' % name
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
-            return
-
-        if not person:
-            msg = 'User "%s" doesn\'t exist' % name
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
-            return
-
-        timezone_name = person['timezone']
-        if timezone_name is None:
-            msg = 'User "%s" doesn\'t share his timezone' % name
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
-            return
-        try:
-            time = datetime.datetime.now(pytz.timezone(timezone_name))
-        except:
-            msg = 'The timezone of "%s" was unknown: "%s"' % (
-                name, timezone_name)
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        if len(set(args['<username>'])) > MAX_USERNAMES:
+            self.reply(mask, target, TOO_MANY_USERNAMES)
             return
 
-        msg = 'The current local time of "%s" is: "%s" (timezone: %s)' % (
-            name, time.strftime('%H:%M'), timezone_name)
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        now = datetime.datetime.now(pytz.utc)
+        self.reply(mask, target, *[
+            self._localtime(name, person, now)
+            for name, person in self._people(args['<username>'])])
 
     @command
+    @threaded
     def members(self, mask, target, args):
         """members <group short name>
 
@@ -463,25 +2747,33 @@ class FedoraPlugin:
         """
         name = args['<group_name>']
 
-        msg = None
         try:
-            group = self.fasclient.group_members(name)
-            members = ''
-            for person in group:
-                if person['role_type'] == 'administrator':
-                    members += '@' + person['username'] + ' '
-                elif person['role_type'] == 'sponsor':
-                    members += '+' + person['username'] + ' '
-                else:
-                    members += person['username'] + ' '
-            msg = 'Members of %s: %s' % (name, members)
+            group = self._group_members(name)
         except AppError:
             msg = 'There is no group %s.' % name
+            self.reply(mask, target, msg)
+            return
 
-        if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        members = chain(
+            ('@' + username for username in group.administrators),
+            ('+' + username for username in group.sponsors),
+            group.users,
+        )
+        self.paginate(mask, target, members, lambda page, number: (
+            'Members of %s: %s' % (name, ' '.join(page))))
+
+    @command
+    def more(self, mask, target, args):
+        """more
+
+        Return the next page of the last long answer you got here.
+
+            %%more
+        """
+        self._next_page(mask, target)
 
     @command
+    @task
     def nextmeeting(self, mask, target, args):
         """nextmeeting <channel>
 
@@ -492,28 +2784,35 @@ class FedoraPlugin:
         channel = args['<channel>']
 
         channel = channel.strip('#').split('@')[0]
-        meetings = sorted(self._future_meetings(channel), key=itemgetter(0))
+        if self.meetings is None:
+            meetings = yield From(self._future_meetings(channel))
+            meetings = sorted(meetings, key=itemgetter(0))
+        else:
+            meetings = self.meetings.upcoming('%s@irc.freenode.net' % channel)
 
         test, meetings = tee(meetings)
         try:
             test.next()
         except StopIteration:
             response = "There are no meetings scheduled for #%s." % channel
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+            self.reply(mask, target, response)
             return
 
-        for date, meeting in islice(meetings, 0, 3):
-            response = "In #%s is %s (starting %s)" % (
+        responses = [
+            "In #%s is %s (starting %s)" % (
                 channel,
                 meeting['meeting_name'],
                 arrow.get(date).humanize(),
             )
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+            for date, meeting in islice(meetings, 0, 3)
+        ]
         base = "https://apps.fedoraproject.org/calendar/location/"
         url = base + urllib.quote("%s@irc.freenode.net/" % channel)
-        self.bot.privmsg(target, '%s: - %s' % (mask.nick, url))
+        self.reply(mask, target, *(responses + [url]))
 
     @command
+    @task
+    @expensive
     def nextmeetings(self, mask, target, args):
         """nextmeetings
 
@@ -521,63 +2820,104 @@ class FedoraPlugin:
 
             %%nextmeetings
         """
-        msg = 'One moment, please...  Looking up the channel list.'
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
-
-        url = 'https://apps.fedoraproject.org/calendar/api/locations/'
-        locations = requests.get(url).json()['locations']
-        meetings = sorted(chain(*[
-            self._future_meetings(location)
-            for location in locations
-            if 'irc.freenode.net' in location
-        ]), key=itemgetter(0))
-
-        test, meetings = tee(meetings)
-        try:
-            test.next()
-        except StopIteration:
-            response = "There are no meetings scheduled at all."
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
-            return
+        if self.meetings is None:
+            msg = 'One moment, please...  Looking up the channel list.'
+            self.reply(mask, target, msg)
+            index = yield From(self._fetch_meetings())
+            meetings = index.upcoming()
+        else:
+            meetings = self.meetings.upcoming()
 
-        for date, meeting in islice(meetings, 0, 5):
-            response = "In #%s is %s (starting %s)" % (
+        responses = [
+            "In #%s is %s (starting %s)" % (
                 meeting['meeting_location'].split('@')[0].strip(),
                 meeting['meeting_name'],
                 arrow.get(date).humanize(),
             )
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+            for date, meeting in islice(meetings, 0, 5)
+        ]
+        if not responses:
+            responses = ["There are no meetings scheduled at all."]
+        self.reply(mask, target, *responses)
 
     @command
-    def pushduty(self, mask, target, args):
-        """pushduty
+    @task
+    @cheap
+    def ownedby(self, mask, target, args):
+        """ownedby <username>
 
-        Return the list of people who are on releng push duty right now.
+        Return the packages owned by a user, per collection.
 
-            %%pushduty
+            %%ownedby <username>
         """
+        name = args['<username>']
+        try:
+            owned = yield From(self._ask_packages(
+                lambda packages: packages.owned_by(name)))
+        except Unavailable:
+            self.reply(mask, target, ACL_LOADING)
+            return
 
-        def get_persons():
-            for meeting in self._meetings_for('release-engineering'):
-                yield meeting['meeting_name']
+        if not owned:
+            msg = '%s does not own any package.' % name
+            self.reply(mask, target, msg)
+            return
 
-        persons = list(get_persons())
+        def render(page, number):
+            listing = '; '.join(
+                '%s: %s' % (
+                    collection, ' '.join(package for _, package in packages))
+                for collection, packages in groupby(page, itemgetter(0)))
+            return 'Packages owned by %s (page %d): %s' % (
+                name, number, listing)
+
+        self.paginate(mask, target, (
+            (collection, package)
+            for collection, packages in owned
+            for package in packages
+        ), render)
+
+    @command
+    @task
+    def pushduty(self, mask, target, args):
+        """pushduty [<when>]
+
+        Return the list of people who are on releng push duty right now, or
+        at the given time (YYYY-MM-DD [HH:MM] UTC, tomorrow, friday, ...).
+
+            %%pushduty [<when>...]
+        """
+        try:
+            when, label = self._when(args['<when>'])
+        except ValueError:
+            msg = 'Sorry, I do not know when "%s" is.' % (
+                ' '.join(args['<when>']))
+            self.reply(mask, target, msg)
+            return
+
+        meetings = yield From(
+            self._meetings_for('release-engineering', when))
+        persons = [meeting['meeting_name'] for meeting in meetings]
 
         url = "https://apps.fedoraproject.org/" + \
             "calendar/release-engineering/"
 
         if not persons:
-            response = "Nobody is listed as being on push duty right now..."
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
-            self.bot.privmsg(target, '%s: - %s' % (mask.nick, url))
+            response = "Nobody is listed as being on push duty %s..." % label
+            self.reply(mask, target, response, url)
             return
 
         persons = ", ".join(persons)
-        response = "The following people are on push duty: %s" % persons
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
-        self.bot.privmsg(target, '%s: - %s' % (mask.nick, url))
+        if when is None:
+            response = "The following people are on push duty: %s" % persons
+        else:
+            response = "The following people are on push duty %s: %s" % (
+                label, persons)
+        self.reply(mask, target, response, url)
 
     @command
+    @task
+    @expensive
     def quote(self, mask, target, args):
         """quote <SYMBOL> [daily, weekly, monthly, quarterly]
 
@@ -630,7 +2970,7 @@ class FedoraPlugin:
         if symbol not in symbols:
             response = "No such symbol %r.  Try one of %s"
             msg = response % (symbol, key_fmt(symbols))
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
             return
 
         # Now, build another lookup of our various timeframes.
@@ -644,28 +2984,33 @@ class FedoraPlugin:
         if frame not in frames:
             response = "No such timeframe %r.  Try one of %s"
             msg = response % (frame, key_fmt(frames))
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
             return
 
         category = [symbols[symbol]]
 
-        t2 = datetime.datetime.utcnow()
+        # The sparkline buckets are aligned on multiples of their width so
+        # the same ones come back from one quote to the next: only the last
+        # one, still open, has to be queried again.
+        t2 = Utils.align(datetime.datetime.utcnow(),
+                         frames[frame] / SPARKLINE_RESOLUTION)
         t1 = t2 - frames[frame]
         t0 = t1 - frames[frame]
 
-        # Count the number of messages between t0 and t1, and between t1 and t2
+        # Count the number of messages between t0 and t1, and between t1 and
+        # t2.  The latter is the sum of the buckets of the sparkline.
         query1 = dict(start=t0, end=t1, category=category)
-        query2 = dict(start=t1, end=t2, category=category)
 
         # Do this async for superfast datagrepper queries.
-        tpool = ThreadPool()
-        batched_values = tpool.map(datagrepper_query, [
-            dict(start=x, end=y, category=category)
-            for x, y in Utils.daterange(t1, t2, SPARKLINE_RESOLUTION)
-        ] + [query1, query2])
+        batched_values = yield From(asyncio.gather(*[
+            self._count(query) for query in [
+                dict(start=x, end=y, category=category)
+                for x, y in Utils.daterange(t1, t2, SPARKLINE_RESOLUTION)
+            ] + [query1]
+        ], loop=self.bot.loop))
 
-        count2 = batched_values.pop()
         count1 = batched_values.pop()
+        count2 = sum(batched_values)
 
         # Just rename the results.  We'll use the rest for the sparkline.
         sparkline_values = batched_values
@@ -708,7 +3053,7 @@ class FedoraPlugin:
             percent=abs(percent),
             phrase=yester_phrases[frame],
         )
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+        self.reply(mask, target, response)
 
         # Now, make a graph out of it.
         sparkline = Utils.sparkline(sparkline_values)
@@ -719,18 +3064,50 @@ class FedoraPlugin:
             sparkline=sparkline,
             phrase=phrases[frame]
         )
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+        self.reply(mask, target, response)
 
-        to_utc = lambda t: time.gmtime(time.mktime(t.timetuple()))
+        to_utc = lambda t: time.gmtime(epoch_seconds(t))
         # And a final line for "x-axis tics"
         t1_fmt = time.strftime("%H:%M UTC %m/%d", to_utc(t1))
         t2_fmt = time.strftime("%H:%M UTC %m/%d", to_utc(t2))
         padding = u" " * (SPARKLINE_RESOLUTION - len(t1_fmt) - 3)
         template = u"     ↑ {t1}{padding}↑ {t2}"
         response = template.format(t1=t1_fmt, t2=t2_fmt, padding=padding)
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+        self.reply(mask, target, response)
+
+    @command
+    @task
+    @cheap
+    def search(self, mask, target, args):
+        """search <words>
+
+        Search the packages whose name or summary match the given words.
+
+            %%search <words>...
+        """
+        text = ' '.join(args['<words>'])
+        try:
+            results, truncated = yield From(self._ask_packages(
+                lambda packages: packages.search.query(text)))
+        except Unavailable:
+            self.reply(mask, target, ACL_LOADING)
+            return
+
+        if not results:
+            msg = 'No package matching "%s".' % text
+        else:
+            msg = 'Packages matching "%s": %s' % (
+                text, ', '.join(results[:SEARCH_RESULTS]))
+            if len(results) > SEARCH_RESULTS:
+                msg = '%s (and %d more)' % (
+                    msg, len(results) - SEARCH_RESULTS)
+        if truncated:
+            msg = ('%s, some words matched too many others, use longer '
+                   'ones for a complete answer' % msg)
+        self.reply(mask, target, msg)
 
     @command
+    @threaded
     def sponsors(self, mask, target, args):
         """sponsors <group short name>
 
@@ -742,51 +3119,62 @@ class FedoraPlugin:
 
         msg = None
         try:
-            group = self.fasclient.group_members(name)
-            sponsors = ''
-            for person in group:
-                if person['role_type'] == 'sponsor':
-                    sponsors += person['username'] + ' '
-                elif person['role_type'] == 'administrator':
-                    sponsors += '@' + person['username'] + ' '
+            group = self._group_members(name)
+            sponsors = ' '.join(chain(
+                group.sponsors,
+                ('@' + username for username in group.administrators),
+            ))
             msg = 'Sponsors for %s: %s' % (name, sponsors)
         except AppError:
             msg = 'There is no group %s.' % name
 
         if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
 
     @command
+    @task
     def vacation(self, mask, target, args):
-        """vacation
+        """vacation [<when>]
 
-        Return the list of people who are on vacation right now according
-        to fedocal.
+        Return the list of people who are on vacation right now, or at the
+        given time (YYYY-MM-DD [HH:MM] UTC, tomorrow, next monday, ...),
+        according to fedocal.
 
-            %%vacation
+            %%vacation [<when>...]
         """
+        try:
+            when, label = self._when(args['<when>'])
+        except ValueError:
+            msg = 'Sorry, I do not know when "%s" is.' % (
+                ' '.join(args['<when>']))
+            self.reply(mask, target, msg)
+            return
 
-        def get_persons():
-            for meeting in self._meetings_for('vacation'):
-                for manager in meeting['meeting_manager']:
-                    yield manager
-
-        persons = list(get_persons())
+        meetings = yield From(self._meetings_for('vacation', when))
+        persons = [
+            manager
+            for meeting in meetings
+            for manager in meeting['meeting_manager']
+        ]
 
         if not persons:
-            response = "Nobody is listed as being on vacation right now..."
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+            response = "Nobody is listed as being on vacation %s..." % label
             url = "https://apps.fedoraproject.org/calendar/vacation/"
-            self.bot.privmsg(target, '%s: - %s' % (mask.nick, url))
+            self.reply(mask, target, response, url)
             return
 
         persons = ", ".join(persons)
-        response = "The following people are on vacation: %s" % persons
-        self.bot.privmsg(target, '%s: %s' % (mask.nick, response))
+        if when is None:
+            response = "The following people are on vacation: %s" % persons
+        else:
+            response = "The following people are on vacation %s: %s" % (
+                label, persons)
         url = "https://apps.fedoraproject.org/calendar/vacation/"
-        self.bot.privmsg(target, '%s: - %s' % (mask.nick, url))
+        self.reply(mask, target, response, url)
 
     @command
+    @task
+    @cheap
     def what(self, mask, target, args):
         """what <package>
 
@@ -795,17 +3183,21 @@ class FedoraPlugin:
             %%what <package>
         """
         package = args['<package>']
-        msg = None
+
         try:
-            summary = self.bugzacl['Fedora'][package]['summary']
+            summary = yield From(self._ask_packages(
+                lambda packages: packages.summary(package)))
             msg = "%s: %s" % (package, summary)
         except KeyError:
             msg = "No such package exists."
+        except Unavailable:
+            msg = ACL_LOADING
 
-        if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        self.reply(mask, target, msg)
 
     @command
+    @task
+    @cheap
     def whoowns(self, mask, target, args):
         """whoowns <package>
 
@@ -815,33 +3207,26 @@ class FedoraPlugin:
         """
 
         package = args['<package>']
-
         try:
-            mainowner = self.bugzacl['Fedora'][package]['owner']
+            mainowner, others = yield From(self._ask_packages(
+                lambda packages: packages.owner(package)))
         except KeyError:
             msg = "No such package exists."
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            self.reply(mask, target, msg)
+            return
+        except Unavailable:
+            self.reply(mask, target, ACL_LOADING)
             return
 
-        others = []
-        for key in self.bugzacl:
-            if key == 'Fedora':
-                continue
-            try:
-                owner = self.bugzacl[key][package]['owner']
-                if owner == mainowner:
-                    continue
-            except KeyError:
-                continue
-            others.append("%s in %s" % (owner, key))
-
-        if others == []:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, mainowner))
+        if not others:
+            self.reply(mask, target, mainowner)
         else:
-            msg = "%s (%s)" % (mainowner, ', '.join(others))
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+            others = ', '.join("%s in %s" % other for other in others)
+            msg = "%s (%s)" % (mainowner, others)
+            self.reply(mask, target, msg)
 
     @command
+    @threaded
     def wikilink(self, mask, target, args):
         """wikilink <username>
 
@@ -851,19 +3236,36 @@ class FedoraPlugin:
         """
         name = args['<username>']
 
-        person = msg = None
+        person = None
         try:
-            person = self.fasclient.person_by_username(name)
-        except:
+            person = self._person(name)
+        except Unavailable:
+            raise
+        except Exception:
             msg = 'Error getting info for user: "%s"' % name
-        if not person:
-            msg = 'User "%s" doesn\'t exist' % name
         else:
-            msg = "[[User:%s|%s]]" % (person["username"],
-                                      person["human_name"] or '')
+            if not person:
+                msg = 'User "%s" doesn\'t exist' % name
+            else:
+                msg = "[[User:%s|%s]]" % (person["username"],
+                                          person["human_name"] or '')
 
-        if msg is not None:
-            self.bot.privmsg(target, '%s: %s' % (mask.nick, msg))
+        self.reply(mask, target, msg)
+
+
+def cache_daemon():
+    """ Run the CacheDaemon configured in the irc3fedora section of the
+    configuration files given on the command line.
+    """
+    logging.config.dictConfig(irc3.config.LOGGING)
+    config = irc3.utils.parse_config('bot', *sys.argv[1:])
+
+    loop = asyncio.get_event_loop()
+
+    daemon = CacheDaemon(loop, config.get(__name__, {}))
+    loop.run_until_complete(daemon.serve())
+
+    loop.run_forever()
 
 
 def main():
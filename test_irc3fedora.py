@@ -0,0 +1,808 @@
+# -*- coding: utf-8 -*-
+""" Tests of the irc3fedora plugin.
+
+The plugin is built without its __init__, which connects to FAS, pkgdb and
+the bus, and the event loop is driven directly.
+"""
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from irc3.compat import asyncio
+from irc3.utils import IrcString
+from trollius import From
+
+import fedmsg.config
+import fedmsg.meta
+import fedmsg.meta.base
+import fedmsg.meta.default
+import zmq
+
+import irc3fedora
+
+
+BUGZACL = {
+    'Fedora': {
+        'bash': {
+            'owner': 'siteshwar', 'summary': 'The GNU Bourne Again shell'},
+        'zsh': {'owner': 'kdudka', 'summary': 'Powerful interactive shell'},
+    },
+}
+
+
+class FakeBot(object):
+
+    nick = 'zodbot'
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.config = {}
+        self.lines = []
+
+    def privmsg(self, target, line):
+        self.lines.append((time.time(), target, line))
+
+
+class SlowFAS(object):
+    """ A FAS client taking ``delay`` seconds to answer. """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.looked_up = []
+
+    def person_by_username(self, username):
+        self.looked_up.append(username)
+        time.sleep(self.delay)
+        return {
+            'username': username, 'human_name': 'Ralph', 'email': 'r@f.org',
+            'creation': '2008-01-01 00:00:00', 'ircnick': username,
+            'timezone': 'UTC', 'locale': 'en', 'gpg_keyid': None,
+            'status': 'active', 'unapproved_memberships': [],
+        }
+
+    def people_query(self, constraints, columns):
+        return []
+
+
+class Plugin(irc3fedora.FedoraPlugin):
+
+    def __init__(self):
+        pass
+
+
+def make_plugin(loop, **attributes):
+    plugin = Plugin()
+    plugin.bot = FakeBot(loop)
+    plugin.log = irc3fedora.logging.getLogger('irc3.test')
+    plugin.config = {}
+    plugin.executor = ThreadPoolExecutor(max_workers=2)
+    plugin.upstream = ThreadPoolExecutor(max_workers=2)
+    plugin.fanout = ThreadPoolExecutor(max_workers=2)
+    plugin.deadline = 10
+    plugin.breakers = dict(
+        fas=irc3fedora.CircuitBreaker('FAS'),
+        pkgdb=irc3fedora.CircuitBreaker('pkgdb'))
+    plugin.scheduler = irc3fedora.Scheduler(limit=2)
+    plugin.outbox = irc3fedora.Outbox(loop, plugin.bot.privmsg, burst=100)
+    plugin.cursors = irc3fedora.Cursors()
+    plugin.persons = irc3fedora.TTLCache('persons')
+    plugin.roles = irc3fedora.TTLCache('roles')
+    plugin.packages = irc3fedora.PackageIndex(BUGZACL)
+    plugin.daemon = None
+    for name, value in attributes.items():
+        setattr(plugin, name, value)
+    return plugin
+
+
+def run(loop, seconds):
+    loop.run_until_complete(asyncio.sleep(seconds, loop=loop))
+
+
+def test_what_answers_while_fas_is_slow():
+    loop = asyncio.new_event_loop()
+    plugin = make_plugin(
+        loop, fasclient=SlowFAS(delay=1),
+        scheduler=irc3fedora.Scheduler(limit=2, high_water=1))
+    mask = IrcString('ralph!ralph@fedora/ralph')
+
+    # Every running slot is taken by a slow command, and the queue is full.
+    for name in ('ralph', 'toshio', 'kevin'):
+        plugin.fasinfo(mask, '#fedora', {'<username>': name})
+    assert plugin.scheduler.running[irc3fedora.NORMAL] == 2
+    assert len(plugin.scheduler.queues[irc3fedora.NORMAL]) == 1
+
+    started = time.time()
+    plugin.what(mask, '#fedora', {'<package>': 'bash'})
+    run(loop, 0.2)
+
+    lines = [line for _, _, line in plugin.bot.lines]
+    assert any('Bourne Again' in line for line in lines)
+    assert not any('User: ralph' in line for line in lines)
+    answered = [when for when, _, line in plugin.bot.lines
+                if 'Bourne Again' in line][0]
+    assert answered - started < 0.2
+
+    # The slow commands still complete.
+    run(loop, 2.5)
+    lines = [line for _, _, line in plugin.bot.lines]
+    for name in ('ralph', 'toshio', 'kevin'):
+        assert any('User: %s' % name in line for line in lines)
+    loop.close()
+
+
+def test_search_keeps_the_most_common_expansions():
+    summaries = dict(
+        ('py%03d' % number, 'a module') for number in range(300))
+    summaries.update({
+        'pyzmq': 'ZeroMQ bindings', 'zeromq-py': 'pyzmq compatibility',
+        'zmq-tools': 'pyzmq tools'})
+    index = irc3fedora.SearchIndex(summaries)
+
+    results, truncated = index.query('py')
+    assert truncated
+    assert set(['pyzmq', 'zeromq-py', 'zmq-tools']) <= set(results)
+
+    results, truncated = index.query('pyzm')
+    assert not truncated
+    assert results[0] == 'pyzmq'
+
+
+class FakeDatagrepper(object):
+    """ Answers every query with ``total`` and remembers its parameters. """
+
+    def __init__(self, loop, total):
+        self.loop = loop
+        self.total = total
+        self.queries = []
+
+    def get_json(self, url, **params):
+        self.queries.append(params)
+        future = asyncio.Future(loop=self.loop)
+        future.set_result({'total': self.total})
+        return future
+
+
+def bus_message(topic, timestamp):
+    """ A message as recorded from the bus. """
+    return {
+        'i': 1,
+        'msg_id': '2026-5e3a1b2c-0000-0000-0000-000000000000',
+        'topic': 'org.fedoraproject.prod.%s' % topic,
+        'timestamp': timestamp,
+        'username': 'apache',
+        'msg': {'agent': 'ralph'},
+    }
+
+
+def test_quote_counts_come_from_the_bus_then_datagrepper():
+    loop = asyncio.new_event_loop()
+    histogram = irc3fedora.Histogram()
+    http = FakeDatagrepper(loop, total=7)
+    plugin = make_plugin(
+        loop, histogram=histogram, http=http,
+        counts=irc3fedora.TTLCache('counts'))
+
+    # The first bucket the histogram saw entirely.
+    start = histogram.first * histogram.resolution
+    for topic, offset in [('bodhi.update.comment', 10),
+                          ('bodhi.update.request.stable', 150),
+                          ('buildsys.build.state.change', 160),
+                          ('bodhi.update.comment', 300)]:
+        message = bus_message(topic, start + offset)
+        plugin._count_message(message['topic'], message)
+
+    window = dict(
+        category=['bodhi'],
+        start=datetime.datetime.utcfromtimestamp(start),
+        end=datetime.datetime.utcfromtimestamp(
+            start + 2 * histogram.resolution))
+    assert loop.run_until_complete(plugin._count(dict(window))) == 2
+    assert not http.queries
+
+    # Before the histogram started, datagrepper is asked, in UTC whatever
+    # the timezone of the host.
+    saved = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/New_York'
+    time.tzset()
+    try:
+        earlier = dict(
+            category=['bodhi'],
+            start=datetime.datetime(2026, 1, 1),
+            end=datetime.datetime(2026, 1, 2))
+        assert loop.run_until_complete(plugin._count(earlier)) == 7
+    finally:
+        if saved is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = saved
+        time.tzset()
+    assert http.queries[0]['start'] == 1767225600
+    assert http.queries[0]['end'] == 1767312000
+    loop.close()
+
+
+def serve_http(loop, answers):
+    """ Serve ``answers``, a dict of path to (status, headers, body). """
+    @asyncio.coroutine
+    def handle(reader, writer):
+        while True:
+            line = yield From(reader.readline())
+            if not line:
+                break
+            path = line.split()[1]
+            while (yield From(reader.readline())).strip():
+                pass
+            status, headers, body = answers[path]
+            headers = dict(headers, **{'Content-Length': str(len(body))})
+            writer.write('HTTP/1.1 %d Whatever\r\n' % status)
+            for name, value in headers.items():
+                writer.write('%s: %s\r\n' % (name, value))
+            writer.write('\r\n' + body)
+        writer.close()
+
+    server = loop.run_until_complete(
+        asyncio.start_server(handle, '127.0.0.1', 0, loop=loop))
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_http_follows_redirects_and_reports_errors():
+    loop = asyncio.new_event_loop()
+    server, port = serve_http(loop, {
+        '/old': (301, {'Location': '/New?Id=1'}, ''),
+        '/New?Id=1': (200, {}, '{"moved": true}'),
+        '/loop': (302, {'Location': '/loop'}, ''),
+        '/missing': (404, {}, '{"error": "no such badge"}'),
+        '/html': (200, {}, '<html></html>'),
+    })
+    http = irc3fedora.HTTPClient(loop, timeout=5)
+    url = 'http://127.0.0.1:%d' % port
+
+    def get_json(path, **kwargs):
+        return loop.run_until_complete(http.get_json(url + path, **kwargs))
+
+    assert get_json('/old') == {'moved': True}
+    assert get_json('/missing', accept_errors=True) == {
+        'error': 'no such badge'}
+    for path, reason in [('/loop', 'with a 302 status'),
+                         ('/missing', 'with a 404 status'),
+                         ('/html', 'something else than JSON')]:
+        try:
+            get_json(path)
+        except irc3fedora.HTTPError as exc:
+            assert str(exc) == '127.0.0.1 answered %s' % reason
+        else:
+            assert False, path
+    server.close()
+    loop.close()
+
+
+def test_user_commands_say_when_fas_is_not_answering():
+    loop = asyncio.new_event_loop()
+    plugin = make_plugin(loop, fasclient=SlowFAS(delay=0.5), deadline=0.1)
+    mask = IrcString('ralph!ralph@fedora/ralph')
+
+    for command in (plugin.fasinfo, plugin.himynameis, plugin.wikilink):
+        command(mask, '#fedora', {'<username>': 'ralph'})
+        run(loop, 0.3)
+    lines = [line for _, _, line in plugin.bot.lines]
+    assert lines == [
+        'ralph: Sorry, FAS is not answering right now, please try again '
+        'later.'] * 3
+    loop.close()
+
+
+def test_nextmeetings_answers_at_once():
+    loop = asyncio.new_event_loop()
+    start = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    meetings = irc3fedora.MeetingIndex([
+        ('fedora-meeting@irc.freenode.net', [
+            (start + datetime.timedelta(hours=hours), {
+                'meeting_location': 'fedora-meeting@irc.freenode.net',
+                'meeting_name': 'Meeting %d' % hours})
+            for hours in range(7)]),
+    ])
+    plugin = make_plugin(loop, meetings=meetings)
+    mask = IrcString('ralph!ralph@fedora/ralph')
+
+    plugin.nextmeetings(mask, '#fedora', {})
+    run(loop, 0.1)
+    lines = [line for _, _, line in plugin.bot.lines]
+    assert len(lines) == 1
+    assert lines[0].count('In #fedora-meeting is Meeting') == 5
+
+    plugin.meetings = irc3fedora.MeetingIndex()
+    plugin.nextmeetings(mask, '#fedora', {})
+    run(loop, 0.1)
+    assert plugin.bot.lines[-1][2] == (
+        'ralph: There are no meetings scheduled at all.')
+    loop.close()
+
+
+def test_localtime_refuses_too_many_usernames():
+    loop = asyncio.new_event_loop()
+    plugin = make_plugin(loop, fasclient=SlowFAS(delay=0))
+    mask = IrcString('ralph!ralph@fedora/ralph')
+
+    names = ['user%d' % number for number in range(31)]
+    plugin.localtime(mask, '#fedora', {'<username>': names})
+    run(loop, 0.2)
+    plugin.localtime(mask, '#fedora', {'<username>': names[:30]})
+    run(loop, 0.2)
+    lines = [line for _, _, line in plugin.bot.lines]
+    assert lines[0] == (
+        'ralph: Sorry, I look up at most 30 usernames at once.')
+    assert 'The current local time of "user29"' in ' '.join(lines[1:])
+    loop.close()
+
+
+def test_prewarm_yields_to_the_commands():
+    loop = asyncio.new_event_loop()
+    start = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+    meetings = irc3fedora.MeetingIndex([
+        ('fedora-meeting@irc.freenode.net', [(start, {
+            'meeting_location': 'fedora-meeting@irc.freenode.net',
+            'meeting_name': 'Roll call'})]),
+    ])
+    fas = SlowFAS(delay=0.05)
+    plugin = make_plugin(
+        loop, fasclient=fas, meetings=meetings, prewarm_before=300,
+        prewarm_limit=5, prewarmed=set())
+    plugin.bot.channels = {
+        '#fedora-meeting': ['zodbot'] + ['user%d' % n for n in range(20)]}
+    mask = IrcString('ralph!ralph@fedora/ralph')
+
+    plugin._prewarm()
+    # At most one lookup of ours runs at once, the command gets a worker.
+    assert plugin.scheduler.running[irc3fedora.EXPENSIVE] == 1
+    plugin.himynameis(mask, '#fedora', {'<username>': 'ralph'})
+    run(loop, 0.2)
+    assert 'ralph' in fas.looked_up[:2]
+    run(loop, 1)
+    assert sorted(fas.looked_up) == [
+        'ralph', 'user0', 'user1', 'user2', 'user3', 'user4']
+
+    # Meetings are warmed once.
+    plugin._prewarm()
+    run(loop, 0.3)
+    assert len(fas.looked_up) == 6
+    loop.close()
+
+
+class FASProcessor(fedmsg.meta.base.BaseProcessor):
+    __name__ = 'FAS'
+    __description__ = 'the Fedora Account System'
+    __link__ = 'https://admin.fedoraproject.org/accounts'
+    __docs__ = 'https://fedoraproject.org/wiki/Account_System'
+    __obj__ = 'Account Changes'
+
+    def usernames(self, msg, **config):
+        return set(filter(None, [
+            msg['msg'].get('agent'), msg['msg'].get('user')]))
+
+
+class PkgdbProcessor(fedmsg.meta.base.BaseProcessor):
+    __name__ = 'pkgdb'
+    __description__ = 'the Fedora package database'
+    __link__ = 'https://admin.fedoraproject.org/pkgdb'
+    __docs__ = 'https://fedoraproject.org/wiki/Pkgdb'
+    __obj__ = 'Package Changes'
+
+    def packages(self, msg, **config):
+        listing = msg['msg'].get('package_listing', msg['msg'])
+        return set([listing['package']['name']])
+
+
+def processors(fm_config):
+    """ The fedmsg.meta processors of the fas and pkgdb messages. """
+    return [
+        processor(lambda text: text, **fm_config)
+        for processor in (FASProcessor, PkgdbProcessor,
+                          fedmsg.meta.default.DefaultProcessor)]
+
+
+def test_bus_messages_invalidate_what_they_are_about():
+    loop = asyncio.new_event_loop()
+    fm_config = dict(topic_prefix_re=r'org\.fedoraproject\.prod')
+    saved = fedmsg.meta.processors
+    fedmsg.meta.processors = processors(fm_config)
+    plugin = make_plugin(
+        loop, fm_config=fm_config, acl_refresh_delay=600, refreshes={},
+        groups=irc3fedora.TTLCache('groups'),
+        branch_lists=irc3fedora.TTLCache('branch lists'))
+    for username in ('ralph', 'toshio', 'kevin'):
+        plugin.persons.set(username, {'username': username})
+        plugin.roles.set(username, ())
+    plugin.groups.set('packager', [])
+    for package in ('bash', 'zsh'):
+        plugin.branch_lists.set(package, ['master'])
+    plugin.refreshes['packages'] = (
+        loop.call_later(3600, lambda: None), None, 3600, False)
+    try:
+        plugin._invalidate('org.fedoraproject.prod.fas.role.update', {
+            'topic': 'org.fedoraproject.prod.fas.role.update',
+            'msg': {'agent': 'ralph', 'user': 'toshio', 'group': 'packager'},
+        })
+        plugin._invalidate('org.fedoraproject.prod.pkgdb.acl.update', {
+            'topic': 'org.fedoraproject.prod.pkgdb.acl.update',
+            'msg': {'agent': 'kevin', 'package_listing': {
+                'package': {'name': 'bash'}, 'collection': {
+                    'branchname': 'master'}}},
+        })
+        run(loop, 0.1)
+    finally:
+        fedmsg.meta.processors = saved
+
+    for cache in (plugin.persons, plugin.roles):
+        assert sorted(cache._data) == ['kevin']
+    assert not plugin.groups._data
+    assert sorted(plugin.branch_lists._data) == ['zsh']
+    # The owners of every package get downloaded again, soon.
+    handle, _, interval, early = plugin.refreshes['packages']
+    assert early and interval == 3600
+    assert handle._when - loop.time() < 600
+    loop.close()
+
+
+class SlowStore(object):
+    """ A store taking ``delay`` seconds to read, remembering the threads
+    it was used from.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.entries = {}
+        self.threads = set()
+
+    def get(self, cache, key):
+        self.threads.add(threading.current_thread())
+        time.sleep(self.delay)
+        return self.entries[cache, key]
+
+    def set(self, cache, key, expires, value, weight=1, maxsize=None):
+        self.threads.add(threading.current_thread())
+        self.entries[cache, key] = (expires, value, weight)
+
+    def delete(self, cache, key):
+        self.entries.pop((cache, key), None)
+
+
+def test_the_store_is_read_off_the_loop_and_without_the_lock():
+    store = SlowStore(delay=0.5)
+    cache = irc3fedora.TTLCache('counts', store=store)
+    cache.set('in memory', 1)
+    store.entries['counts', 'stored'] = (time.time() + 60, 2, 1)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        stored = executor.submit(cache.get, 'stored')
+        time.sleep(0.1)
+        started = time.time()
+        assert cache.get('in memory') == 1
+        assert time.time() - started < 0.1
+        assert stored.result() == 2
+
+    loop = asyncio.new_event_loop()
+    plugin = make_plugin(
+        loop, histogram=None, http=FakeDatagrepper(loop, total=7),
+        counts=irc3fedora.TTLCache('counts', store=SlowStore(delay=0)))
+    query = dict(
+        category=['bodhi'], start=datetime.datetime(2026, 1, 1),
+        end=datetime.datetime(2026, 1, 2))
+    assert loop.run_until_complete(plugin._count(dict(query))) == 7
+    run(loop, 0.1)
+    assert loop.run_until_complete(plugin._count(dict(query))) == 7
+    assert len(plugin.http.queries) == 1
+    assert threading.current_thread() not in plugin.counts.store.threads
+    loop.close()
+
+
+def test_the_daemon_wire_carries_data_only():
+    meetings = irc3fedora.MeetingIndex([
+        ('fedora-meeting@irc.freenode.net', [
+            (datetime.datetime(2026, 10, 17, 15, 30), {
+                'meeting_name': 'Roll call'})]),
+    ])
+    members = irc3fedora.GroupMembers(('ralph',), (), ('toshio', 'kevin'))
+    value = ('persons', 'ralph', 1.5, [members, meetings, None, True])
+
+    data = irc3fedora.wire_dumps(value)
+    assert 'irc3fedora' not in data
+    answer = irc3fedora.wire_loads(data)
+    assert answer[:3] == value[:3]
+    assert answer[3][0] == members
+    assert answer[3][0].users == ('toshio', 'kevin')
+    assert answer[3][2:] == [None, True]
+    assert [name for _, meeting in answer[3][1].upcoming(
+        now=datetime.datetime(2026, 10, 17)) for name in meeting.values()
+    ] == ['Roll call']
+
+    try:
+        irc3fedora.wire_dumps(irc3fedora.PackageIndex(BUGZACL))
+    except TypeError:
+        pass
+    else:
+        assert False
+
+
+def test_the_daemon_serves_our_user_from_a_private_directory():
+    directory = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    try:
+        path = os.path.join(directory, 'irc3fedora', 'cache.sock')
+        daemon = irc3fedora.CacheDaemon(loop, {'cache_daemon': path})
+        daemon._refresh = lambda: None
+        daemon.packages = irc3fedora.PackageIndex(BUGZACL)
+        server = loop.run_until_complete(daemon.serve())
+        assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+
+        client = irc3fedora.CacheClient(path)
+        plugin = make_plugin(
+            loop, daemon=client, nearby=ThreadPoolExecutor(max_workers=1),
+            packages=irc3fedora.RemotePackageIndex(client))
+        mask = IrcString('ralph!ralph@fedora/ralph')
+        # Commands stuck upstream do not hold the daemon's answers back.
+        for _ in range(2):
+            plugin.executor.submit(time.sleep, 1)
+        plugin.whoowns(mask, '#fedora', {'<package>': 'bash'})
+        plugin.what(mask, '#fedora', {'<package>': 'nothing'})
+        run(loop, 0.3)
+        lines = [line for _, _, line in plugin.bot.lines]
+        assert sorted(lines) == [
+            'ralph: No such package exists.', 'ralph: siteshwar']
+
+        # A daemon not answering is a package list still loading.
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        os.remove(path)
+        plugin.daemon = irc3fedora.CacheClient(path)
+        plugin.packages = irc3fedora.RemotePackageIndex(plugin.daemon)
+        plugin.what(mask, '#fedora', {'<package>': 'bash'})
+        run(loop, 0.3)
+        assert plugin.bot.lines[-1][2] == 'ralph: ' + irc3fedora.ACL_LOADING
+
+        # Nor does it listen in a directory others may write to.
+        os.chmod(os.path.dirname(path), 0o777)
+        try:
+            loop.run_until_complete(daemon.serve())
+        except IOError:
+            pass
+        else:
+            assert False
+    finally:
+        loop.close()
+        shutil.rmtree(directory)
+
+
+def test_cheap_commands_are_never_queued_nor_refused():
+    loop = asyncio.new_event_loop()
+    scheduler = irc3fedora.Scheduler(limit=1, high_water=1)
+    started = []
+
+    def start(name):
+        def started_it():
+            started.append(name)
+            return asyncio.Future(loop=loop)
+        return started_it
+
+    for name in ('slow', 'queued'):
+        assert scheduler.submit(
+            '#fedora', 'ralph', irc3fedora.NORMAL, start(name))
+    assert not scheduler.submit(
+        '#fedora', 'ralph', irc3fedora.NORMAL, start('refused'))
+    assert scheduler.submit(
+        '#fedora', 'ralph', irc3fedora.CHEAP, start('cheap'))
+    assert started == ['slow', 'cheap']
+    loop.close()
+
+
+def test_the_daemon_answers_while_its_database_is_slow():
+    directory = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    try:
+        private = os.path.join(directory, 'irc3fedora')
+        daemon = irc3fedora.CacheDaemon(loop, {
+            'cache_daemon': os.path.join(private, 'cache.sock'),
+            'cache_store': os.path.join(directory, 'cache.sqlite')})
+        daemon._refresh = lambda: None
+        daemon.packages = irc3fedora.PackageIndex(BUGZACL)
+        daemon.store = SlowStore(delay=1)
+        daemon.store.entries['persons', 'ralph'] = (0, 'Ralph', 1)
+        server = loop.run_until_complete(daemon.serve())
+
+        clients = ThreadPoolExecutor(max_workers=2)
+        answered = []
+
+        def call(*request):
+            result = irc3fedora.CacheClient(daemon.path, timeout=5).call(
+                *request)
+            answered.append((time.time(), result))
+
+        started = time.time()
+        stored = loop.run_in_executor(
+            clients, call, 'get', 'persons', 'ralph')
+        run(loop, 0.1)
+        loop.run_until_complete(
+            loop.run_in_executor(clients, call, 'packages', 'len'))
+        loop.run_until_complete(stored)
+        assert answered[0][1] == 2
+        assert answered[0][0] - started < 0.5
+        assert answered[1][1] == (0, 'Ralph', 1)
+        clients.shutdown()
+        server.close()
+        run(loop, 0.1)
+    finally:
+        loop.close()
+        shutil.rmtree(directory)
+
+
+def test_roll_calls_say_when_fas_is_not_answering():
+    loop = asyncio.new_event_loop()
+    plugin = make_plugin(loop, fasclient=SlowFAS(delay=0.5), deadline=0.1)
+    mask = IrcString('ralph!ralph@fedora/ralph')
+
+    for command in (plugin.hellomynameis, plugin.localtime):
+        command(mask, '#fedora', {'<username>': ['ralph', 'toshio']})
+        run(loop, 0.3)
+    lines = [line for _, _, line in plugin.bot.lines]
+    assert lines == [
+        'ralph: Sorry, FAS is not answering right now, please try again '
+        'later.'] * 2
+    loop.close()
+
+
+def test_the_sqlite_store_keeps_json():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'cache.sqlite')
+        # A database of the pickling days is started over.
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE entries (cache TEXT, key BLOB, value BLOB)')
+        db.execute("INSERT INTO entries VALUES ('persons', 'x', 'cos')")
+        db.commit()
+        db.close()
+
+        store = irc3fedora.SQLiteStore(path)
+        members = irc3fedora.GroupMembers(('ralph',), (), ('toshio',))
+        key = (('bodhi',), datetime.datetime(2026, 1, 1))
+        store.set('groups', 'packager', 60.0, members)
+        store.set('counts', key, 60.0, 7)
+        assert store.get('groups', 'packager') == (60.0, members, 1)
+        assert store.get('counts', key) == (60.0, 7, 1)
+
+        db = sqlite3.connect(path)
+        values = [value for value, in db.execute('SELECT value FROM entries')]
+        assert sorted(values) == ['7', '{"!group":{"administrators":'
+                                  '{"!tuple":["ralph"]},"sponsors":'
+                                  '{"!tuple":[]},"users":'
+                                  '{"!tuple":["toshio"]}}}']
+        db.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+class SilentHTTP(object):
+    """ Never answers. """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def get(self, url, **params):
+        return asyncio.Future(loop=self.loop)
+
+
+def test_the_snapshot_is_loaded_in_the_background():
+    directory = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    try:
+        snapshot = os.path.join(directory, 'bugzacl.json')
+        with open(snapshot, 'w') as stream:
+            json.dump({'bugzillaAcls': BUGZACL}, stream)
+        plugin = make_plugin(
+            loop, packages=irc3fedora.PackageIndex(), refreshes={},
+            acl_snapshot=snapshot, acl_timeout=300, http=SilentHTTP(loop))
+        mask = IrcString('ralph!ralph@fedora/ralph')
+
+        plugin.refresh('packages', plugin._download_acls, 3600)
+        plugin.what(mask, '#fedora', {'<package>': 'bash'})
+        assert not plugin.packages
+        run(loop, 0.3)
+        plugin.what(mask, '#fedora', {'<package>': 'bash'})
+        run(loop, 0.1)
+        lines = [line for _, _, line in plugin.bot.lines]
+        assert lines == [
+            'ralph: ' + irc3fedora.ACL_LOADING,
+            'ralph: bash: The GNU Bourne Again shell']
+    finally:
+        loop.close()
+        shutil.rmtree(directory)
+
+
+def test_the_bus_is_followed_on_its_endpoints():
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind('tcp://127.0.0.1:*')
+    loop = asyncio.new_event_loop()
+    fm_config = dict(
+        fedmsg.config.defaults, endpoints={},
+        topic_prefix_re=r'org\.fedoraproject\.prod')
+    plugin = make_plugin(
+        loop, fm_config=fm_config, bus_handlers=[], refreshes={},
+        acl_refresh_delay=600, groups=irc3fedora.TTLCache('groups'),
+        branch_lists=irc3fedora.TTLCache('branch lists'),
+        config={'bus_endpoints': publisher.getsockopt(zmq.LAST_ENDPOINT)})
+    plugin.persons.set('ralph', {'username': 'ralph'})
+    plugin.persons.set('kevin', {'username': 'kevin'})
+
+    def publish(message):
+        publisher.send_multipart(
+            [message['topic'].encode('utf-8'), json.dumps(message)])
+
+    def wait_for(condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        assert condition()
+
+    saved = fedmsg.meta.processors
+    fedmsg.meta.processors = processors(fm_config)
+    try:
+        plugin._follow_bus()
+        histogram = plugin.histogram
+        start = histogram.first * histogram.resolution
+
+        # The subscription takes a moment to reach the publisher.
+        def listening():
+            publish(bus_message('buildsys.build.state.change', start))
+            return 'buildsys' in histogram.counts
+        wait_for(listening)
+
+        for topic, offset in [('bodhi.update.comment', 10),
+                              ('bodhi.update.request.stable', 150),
+                              ('bodhi.update.comment', 300)]:
+            publish(bus_message(topic, start + offset))
+        role_update = bus_message('fas.role.update', start + 20)
+        role_update['msg'] = {'agent': 'ralph', 'group': 'packager'}
+        publish(role_update)
+        wait_for(lambda: 'ralph' not in plugin.persons._data)
+    finally:
+        fedmsg.meta.processors = saved
+        publisher.close()
+        context.term()
+
+    assert sorted(plugin.persons._data) == ['kevin']
+    window = dict(
+        category=['bodhi'],
+        start=datetime.datetime.utcfromtimestamp(start),
+        end=datetime.datetime.utcfromtimestamp(
+            start + 2 * histogram.resolution))
+    assert loop.run_until_complete(plugin._count(window)) == 2
+    loop.close()
+
+
+def test_single_flight_waiters_get_what_stopped_the_leader():
+    flights = irc3fedora.SingleFlight('test')
+    leading = threading.Event()
+
+    def leader():
+        leading.set()
+        time.sleep(0.2)
+        raise SystemExit(1)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        led = executor.submit(flights.do, 'key', leader)
+        leading.wait()
+        waited = executor.submit(flights.do, 'key', lambda: 'not called')
+        for future in (led, waited):
+            try:
+                future.result(timeout=2)
+            except SystemExit:
+                pass
+            else:
+                assert False
+    assert flights.saved == 1